@@ -1,40 +1,67 @@
 # fastapi_main.py
 
-from fastapi import FastAPI, UploadFile, File, Form
-from pydantic import BaseModel
-from typing import Optional
-import shutil
+from fastapi import FastAPI, UploadFile, File, Form, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Literal, Optional
+import asyncio
 import os
-from pathlib import Path
+import json
 import uvicorn
 
-from src.ingestion.load_json_and_chunk import load_json_data
-from src.vector_space.vectordb import build_faiss_index
+from src.vector_space.vectordb import sync_faiss_index
 from src.ingestion.process_image import preprocess_image  # Returns caption
+from src.embedding.model_registry import warm_up, unload
+from src.embedding.embedding_cache import embedding_cache_stats
 from src.rag_pipeline.retriever import (
     load_faiss_index,
-    retrieve_by_text,
-    retrieve_by_image,
-    retrieve_by_text_and_image
+    aembed_query_image,
+    aembed_query_text,
+    search_by_vector,
+    query_batching_stats,
 )
-from src.utils.prompt_builder import build_prompt
-from src.utils.run_llm import run_llm
+from src.rag_pipeline.answer_cache import answer_cache, cache_scope
+from src.rag_pipeline.reranker import RERANK_ENABLED, rerank_stats
+from src.rag_pipeline.batch_query import BATCH_SIZE, answer_batch
+from src.ingestion.load_json_and_chunk import iter_batches
+from src.utils.prompt_builder import build_prompt, context_metadata
+from src.utils.run_llm import arun_llm, astream_llm
+from src.utils.inference_executor import run_inference, shutdown_executor, InferenceBusyError
+from src.utils.uploads import UPLOAD_MAX_BYTES, UPLOAD_PERSIST, UploadError, decode_upload, store_upload
 
 INDEX_PATH = "Dataset/processed_data/faiss.index"
 JSON_PATH = "Dataset/text-data_json"
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "10000"))  # per /query_batch request
 
 app = FastAPI(title="Multimodal RAG API - Customer Support")
+_reindex_lock = asyncio.Lock()  # one /reindex per worker; sync_faiss_index also locks across workers
 
 # -------------------------- Startup --------------------------
 @app.on_event("startup")
 def startup_event():
     global vectorstore
-    if not Path(INDEX_PATH).exists():
-        print("No index found. Building new FAISS index...")
-        chunks = load_json_data(JSON_PATH, chunk_size=300, chunk_overlap=50, debug=True)
-        build_faiss_index(chunks, INDEX_PATH, debug=True)
+    sync_faiss_index(JSON_PATH, INDEX_PATH, chunk_size=300, chunk_overlap=50, debug=True)
     vectorstore = load_faiss_index(INDEX_PATH)
-    print("✅ FAISS index loaded with", len(vectorstore.docstore._dict), "documents.")
+    print("✅ FAISS index loaded with", len(vectorstore), "documents.")
+    warm_up("clip")  # every query embeds with CLIP; BLIP stays lazy
+    if RERANK_ENABLED:
+        warm_up("reranker")
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    shutdown_executor()
+    unload()
+
+
+@app.exception_handler(InferenceBusyError)
+async def inference_busy_handler(request: Request, exc: InferenceBusyError):
+    return JSONResponse(status_code=503, content={"error": str(exc)}, headers={"Retry-After": "1"})
+
+
+@app.exception_handler(UploadError)
+async def upload_error_handler(request: Request, exc: UploadError):
+    return JSONResponse(status_code=exc.status, content={"error": str(exc)})
 
 
 # -------------------------- Models --------------------------
@@ -42,50 +69,172 @@ class QueryRequest(BaseModel):
     query: Optional[str] = None
     image_path: Optional[str] = None
     top_k: int = 4
+    # Optional filters applied before the index scan (e.g. the product-page widget passes its ASIN)
+    asins: Optional[List[str]] = None
+    category: Optional[str] = None
+    source_file: Optional[str] = None
+
+    def filters(self):
+        filters = {"asin": self.asins, "category": self.category, "source_file": self.source_file}
+        return {field: value for field, value in filters.items() if value is not None} or None
+
+    def cache_scope(self):
+        """Answers are only reused between queries with the same top_k, filters and named ASINs."""
+        return cache_scope(self.top_k, self.filters(), vectorstore.named_asins(self.query))
 
 
 # -------------------------- Endpoints --------------------------
 
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics():
+    return {"answer_cache": answer_cache.stats(), "query_batching": query_batching_stats(),
+            "embedding_cache": embedding_cache_stats(), "reranker": rerank_stats()}
+
+
+@app.post("/reindex")
+async def reindex():
+    """Apply catalog changes under JSON_PATH to the index and swap in the updated store."""
+    global vectorstore
+    async with _reindex_lock:
+        changed = await run_inference(sync_faiss_index, JSON_PATH, INDEX_PATH, chunk_size=300, chunk_overlap=50,
+                                      debug=False)
+        if changed:
+            vectorstore = await run_inference(load_faiss_index, INDEX_PATH)
+    return {"changed": changed, "documents": len(vectorstore)}
+
+
 @app.post("/query_text")
 async def query_text(request: QueryRequest):
     if not request.query:
         return {"error": "Provide a text query."}
-    docs = retrieve_by_text(vectorstore, request.query, k=request.top_k)
-    prompt = build_prompt(request.query, docs)
-    answer = run_llm(prompt)
+    q_vec = await aembed_query_text(request.query)
+    scope = request.cache_scope()
+    cached = answer_cache.lookup(q_vec, scope=scope)
+    if cached is not None:
+        return {"answer": cached["answer"], "cached": True}
+
+    docs = await run_inference(search_by_vector, vectorstore, q_vec, k=request.top_k, query_text=request.query,
+                               filters=request.filters())
+    prompt = await run_inference(build_prompt, request.query, docs)
+    answer = await arun_llm(prompt)
+    answer_cache.store(q_vec, {"answer": answer, "context": context_metadata(docs)}, scope=scope)
     return {"answer": answer}
 
 
+@app.post("/query_text/stream")
+async def query_text_stream(request: QueryRequest):
+    """
+    Server-Sent Events: one "context" event with the retrieved docs' metadata,
+    then "token" events as Gemini generates, then "done" (or "error").
+    """
+    if not request.query:
+        return {"error": "Provide a text query."}
+    q_vec = await aembed_query_text(request.query)
+    scope = request.cache_scope()
+    cached = answer_cache.lookup(q_vec, scope=scope)
+    if cached is not None:
+        async def cached_events():
+            yield _sse("context", {"docs": cached["context"], "cached": True})
+            yield _sse("token", {"text": cached["answer"]})
+            yield _sse("done", {})
+
+        return StreamingResponse(cached_events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+    docs = await run_inference(search_by_vector, vectorstore, q_vec, k=request.top_k, query_text=request.query,
+                               filters=request.filters())
+    prompt = await run_inference(build_prompt, request.query, docs)
+    context = context_metadata(docs)
+
+    async def events():
+        yield _sse("context", {"docs": context})
+        parts = []
+        try:
+            async for text in astream_llm(prompt):
+                parts.append(text)
+                yield _sse("token", {"text": text})
+        except Exception as e:
+            yield _sse("error", {"error": str(e)})
+            return
+        answer_cache.store(q_vec, {"answer": "".join(parts), "context": context}, scope=scope)
+        yield _sse("done", {})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.post("/query_batch")
+async def query_batch(request: Request, generate: bool = True):
+    """
+    Bulk queries (offline jobs, ticket backfills). The body is JSONL: one QueryRequest per line,
+    plus an optional "id" (defaults to the line number). The response is JSONL with one
+    {"id", "context", "answer"} or {"id", "error"} per input line, in order.
+    Queries are embedded and searched in batches; LLM calls run with bounded concurrency.
+    generate=false returns only the retrieved context.
+    Server-side image paths are not accepted here (upload images through /query_image instead).
+    """
+    records = []
+    for line_no, line in enumerate((await request.body()).decode("utf-8").splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            QueryRequest(**record)
+        except (ValueError, TypeError, ValidationError) as e:
+            return JSONResponse(status_code=422, content={"error": f"line {line_no}: {e}"})
+        if record.get("image_path"):
+            return JSONResponse(status_code=422, content={"error": f"line {line_no}: image_path is not accepted over HTTP."})
+        record.setdefault("id", line_no)
+        records.append(record)
+    if len(records) > BATCH_MAX_QUERIES:
+        return JSONResponse(status_code=413, content={"error": f"At most {BATCH_MAX_QUERIES} queries per request."})
+
+    results = []
+    for batch in iter_batches(records, BATCH_SIZE):
+        results.extend(await answer_batch(vectorstore, batch, generate=generate, run_blocking=run_inference))
+    body = "".join(json.dumps(result, ensure_ascii=False) + "\n" for result in results)
+    return Response(content=body, media_type="application/x-ndjson")
+
+
+async def _read_query_image(file: UploadFile):
+    """Read and decode an upload in memory (at most UPLOAD_MAX_BYTES); persisted by content hash only with UPLOAD_PERSIST."""
+    data = await file.read(UPLOAD_MAX_BYTES + 1)
+    query_image = await run_inference(decode_upload, data)
+    if UPLOAD_PERSIST:
+        await run_inference(store_upload, query_image)
+    return query_image
+
+
 @app.post("/query_image")
 async def query_image(file: UploadFile = File(...), top_k: int = Form(4)):
-    upload_dir = "uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    docs = retrieve_by_image(vectorstore, file_path, k=top_k)
-    prompt = build_prompt("", docs, query_image_path=file_path)
-    answer = run_llm(prompt)
+    upload = await _read_query_image(file)
+    image_vec = await aembed_query_image(upload.image)
+    docs = await run_inference(search_by_vector, vectorstore, image_vec=image_vec, k=top_k)
+    prompt = await run_inference(build_prompt, "", docs, query_image=upload)
+    answer = await arun_llm(prompt)
     return {"answer": answer}
 
 
 @app.post("/query_image_text")
-async def query_image_text(file: UploadFile = File(...), query: str = Form(...), top_k: int = Form(4)):
-    upload_dir = "uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    docs = retrieve_by_text_and_image(vectorstore, query, file_path, k=top_k)
-    prompt = build_prompt(query, docs, query_image_path=file_path)
-    answer = run_llm(prompt)
+async def query_image_text(file: UploadFile = File(...), query: str = Form(...), top_k: int = Form(4),
+                           text_weight: float = Form(0.5, ge=0.0, le=1.0),
+                           fusion: Literal["weighted", "rrf"] = Form("weighted")):
+    upload = await _read_query_image(file)
+    text_vec, image_vec = await asyncio.gather(aembed_query_text(query), aembed_query_image(upload.image))
+    docs = await run_inference(search_by_vector, vectorstore, text_vec, k=top_k, image_vec=image_vec, fusion=fusion,
+                               text_weight=text_weight, query_text=query)
+    prompt = await run_inference(build_prompt, query, docs, query_image=upload)
+    answer = await arun_llm(prompt)
     return {"answer": answer}
 
 
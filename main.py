@@ -137,8 +137,7 @@
 from pathlib import Path
 from textwrap import shorten
 
-from src.ingestion.load_json_and_chunk import load_json_data
-from src.vector_space.vectordb import build_faiss_index
+from src.vector_space.vectordb import sync_faiss_index
 from src.utils.prompt_builder import build_prompt
 from src.utils.run_llm import run_llm
 from src.rag_pipeline.retriever import (
@@ -155,17 +154,13 @@ JSON_PATH = "Dataset/text-data_json"
 
 # -------------------------- Indexing --------------------------
 def ensure_index():
-    if not Path(INDEX_PATH).exists():
-        print("No index found. Building new FAISS index...")
-        chunks = load_json_data(JSON_PATH, chunk_size=300, chunk_overlap=50, debug=True)
-        build_faiss_index(chunks, INDEX_PATH, debug=True)
-    else:
-        print("Index already exists. Skipping build.")
+    # Builds the index if missing, otherwise only re-embeds new or changed products
+    sync_faiss_index(JSON_PATH, INDEX_PATH, chunk_size=300, chunk_overlap=50, debug=True)
 
 
 def get_vectorstore():
     vectorstore = load_faiss_index(INDEX_PATH)
-    print("✅ Loaded FAISS index with", len(vectorstore.docstore._dict), "documents.")
+    print("✅ Loaded FAISS index with", len(vectorstore), "documents.")
     return vectorstore
 
 
@@ -181,7 +176,7 @@ def answer_question(vectorstore, query: str):
         print("   Snip:", shorten(d.page_content.replace('\n', ' '), width=140, placeholder=" …"))
 
     prompt = build_prompt(query, docs)
-    answer = run_llm(prompt)
+    answer = run_llm(prompt, debug=True)
 
     # Run evaluation 👇
     contexts = [[doc.page_content for doc in docs]]
@@ -206,7 +201,7 @@ def answer_image_question(vectorstore, image_path: str, query: str = None):
         print("   Snip:", shorten(d.page_content.replace('\n', ' '), width=140, placeholder=" …"))
 
     prompt = build_prompt(query or "", docs, query_image_path=image_path)
-    answer = run_llm(prompt)
+    answer = run_llm(prompt, debug=True)
 
 
 
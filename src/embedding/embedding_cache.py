@@ -0,0 +1,98 @@
+# Persistent CLIP embedding cache keyed by model + content hash (chunk text or image bytes)
+
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from src.embedding.model_registry import model_tag
+
+# ONNX/int8 vectors differ slightly from PyTorch ones, so each backend has its own keys
+MODEL_TAG = model_tag("clip")  # includes the ONNX export in use, so variants never share entries
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "Dataset/processed_data/embedding_cache.sqlite")
+
+_conn = None
+_lock = threading.Lock()
+_stats = {"text": {"hits": 0, "misses": 0}, "image": {"hits": 0, "misses": 0}}
+
+
+def _connection():
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(EMBEDDING_CACHE_PATH), exist_ok=True)
+        # parallel build workers share the file, so wait for each other's writes instead of failing
+        _conn = sqlite3.connect(EMBEDDING_CACHE_PATH, check_same_thread=False, timeout=30)
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        _conn.commit()
+    return _conn
+
+
+def text_key(text: str) -> str:
+    """Cache key: embedding model + sha256 of the text."""
+    return f"{MODEL_TAG}:text:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+def image_key(data: bytes) -> str:
+    """Cache key: embedding model + sha256 of the image bytes."""
+    return f"{MODEL_TAG}:image:{hashlib.sha256(data).hexdigest()}"
+
+
+def get_embeddings(keys, kind):
+    """Return {key: float32 vector} for the keys already cached, counting hits/misses for kind."""
+    found = {}
+    with _lock:
+        conn = _connection()
+        unique = list(dict.fromkeys(keys))
+        for start in range(0, len(unique), 500):  # stay under SQLite's bound-parameter limit
+            batch = unique[start:start + 500]
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            found.update((key, np.frombuffer(blob, dtype="float32")) for key, blob in rows)
+        hits = sum(key in found for key in keys)
+        _stats[kind]["hits"] += hits
+        _stats[kind]["misses"] += len(keys) - hits
+    return found
+
+
+def put_embeddings(keys, vectors):
+    with _lock:
+        conn = _connection()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+            [(key, np.asarray(vec, dtype="float32").tobytes()) for key, vec in zip(keys, vectors)],
+        )
+        conn.commit()
+
+
+def cached_embed(keys, items, embed_fn, kind):
+    """
+    Embed items (one cache key each) with embed_fn(list_of_items) -> (n, dim) array,
+    calling it only for the items whose key is not cached yet; duplicates are embedded once.
+    """
+    cached = get_embeddings(keys, kind)
+    missing = {}
+    for key, item in zip(keys, items):
+        if key not in cached:
+            missing.setdefault(key, item)
+
+    if missing:
+        vectors = embed_fn(list(missing.values()))
+        put_embeddings(list(missing), vectors)
+        cached.update(zip(missing, vectors))
+
+    return np.stack([cached[key] for key in keys]).astype("float32")
+
+
+def embedding_cache_stats():
+    with _lock:
+        stats = {kind: dict(counts) for kind, counts in _stats.items()}
+    for counts in stats.values():
+        total = counts["hits"] + counts["misses"]
+        counts["hit_rate"] = counts["hits"] / total if total else 0.0
+    return stats
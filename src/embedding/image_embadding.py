@@ -1,22 +1,17 @@
 # Image embedding using CLIP
 
+import io
+import numpy as np
 import torch
-from PIL import Image
-from transformers import CLIPProcessor, CLIPModel
+from src.embedding.model_registry import get_clip, tensor_format, uses_onnx
+from src.embedding.embedding_cache import cached_embed, image_key
+from src.utils.uploads import to_rgb
 
-clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-
-def embed_image(image_path, debug=True):
+def embed_image(image_path, debug=True, use_cache=True):
     """
     Generate image embedding using CLIP.
     """
-    img = Image.open(image_path).convert("RGB")
-    inputs = clip_processor(images=img, return_tensors="pt")
-    with torch.no_grad():
-        features = clip_model.get_image_features(**inputs)
-        features = features / features.norm(dim=-1, keepdim=True)
-    embedding = features.squeeze().numpy()
+    embedding = embed_images([image_path], use_cache=use_cache)[0]
 
     if debug:
         print(f"\n[DEBUG] Image path: {image_path}")
@@ -24,3 +19,46 @@ def embed_image(image_path, debug=True):
         print(f"Embedding sample: {embedding[:5]}")
 
     return embedding
+
+
+def _embed_image_batches(images, batch_size=16, debug=False):
+    """images: PIL images or anything PIL can open (paths or file objects)."""
+    clip_model, clip_processor = get_clip()
+    batches = []
+    for start in range(0, len(images), batch_size):
+        batch = list(images[start:start + batch_size])
+        imgs = [to_rgb(p) for p in batch]
+        inputs = clip_processor(images=imgs, return_tensors=tensor_format())
+        if uses_onnx():
+            batches.append(clip_model.get_image_features(**inputs))  # already normalized
+        else:
+            with torch.no_grad():
+                features = clip_model.get_image_features(**inputs)
+                features = features / features.norm(dim=-1, keepdim=True)
+            batches.append(features.numpy())
+
+        if debug:
+            print(f"[DEBUG] Embedded image batch {start // batch_size + 1} ({len(batch)} images)")
+
+    if not batches:
+        return np.zeros((0, clip_model.config.projection_dim), dtype="float32")
+    return np.concatenate(batches).astype("float32")
+
+
+def embed_images(image_paths, batch_size=16, debug=False, use_cache=True):
+    """
+    Generate CLIP image embeddings for a list of image paths, batch_size images per forward pass.
+    Returns a float32 array of shape (len(image_paths), dim).
+    With use_cache, images whose bytes were embedded before are read from the persistent
+    embedding cache (each file is read once, to hash it) and only the rest go through CLIP.
+    """
+    if not use_cache or not len(image_paths):
+        return _embed_image_batches(image_paths, batch_size, debug)
+
+    contents = []
+    for path in image_paths:
+        with open(path, "rb") as f:
+            contents.append(f.read())
+    return cached_embed([image_key(data) for data in contents], contents,
+                        lambda batch: _embed_image_batches([io.BytesIO(d) for d in batch], batch_size, debug),
+                        "image")
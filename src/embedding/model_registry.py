@@ -0,0 +1,140 @@
+# Process-wide registry for the CLIP, BLIP and reranker models, loaded lazily on first use
+
+import gc
+import os
+import threading
+
+CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"
+BLIP_MODEL_NAME = "Salesforce/blip-image-captioning-base"
+# Cross-encoder for the optional rerank stage: "BAAI/bge-reranker-large" (best, slowest on CPU),
+# "BAAI/bge-reranker-base" or "cross-encoder/ms-marco-MiniLM-L-6-v2" (fastest)
+RERANKER_MODEL_NAME = os.getenv("RERANKER_MODEL_NAME", "BAAI/bge-reranker-base")
+RERANKER_QUANTIZE = os.getenv("RERANKER_QUANTIZE", "0") == "1"  # int8 dynamic quantization of Linear layers
+
+# "torch" (eager PyTorch fp32) or "onnx" (onnxruntime, int8 when exported; see onnx_backend)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+
+_models = {}
+_lock = threading.Lock()
+
+
+def _load_clip_torch():
+    from transformers import CLIPProcessor, CLIPModel
+    model = CLIPModel.from_pretrained(CLIP_MODEL_NAME).eval()
+    processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+    return model, processor
+
+
+def _load_blip_torch():
+    from transformers import BlipProcessor, BlipForConditionalGeneration
+    model = BlipForConditionalGeneration.from_pretrained(BLIP_MODEL_NAME).eval()
+    processor = BlipProcessor.from_pretrained(BLIP_MODEL_NAME)
+    return model, processor
+
+
+def _load_reranker_torch():
+    import torch
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+    model = AutoModelForSequenceClassification.from_pretrained(RERANKER_MODEL_NAME).eval()
+    if RERANKER_QUANTIZE:
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    tokenizer = AutoTokenizer.from_pretrained(RERANKER_MODEL_NAME)
+    return model, tokenizer
+
+
+def _load_clip_onnx():
+    from transformers import CLIPProcessor
+    from src.embedding.onnx_backend import load_onnx_clip
+    return load_onnx_clip(), CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+
+
+def _load_blip_onnx():
+    from transformers import BlipProcessor
+    from src.embedding.onnx_backend import load_onnx_blip
+    return load_onnx_blip(), BlipProcessor.from_pretrained(BLIP_MODEL_NAME)
+
+
+# The reranker has no ONNX export and always runs in PyTorch
+_BACKENDS = {
+    "torch": {"clip": _load_clip_torch, "blip": _load_blip_torch, "reranker": _load_reranker_torch},
+    "onnx": {"clip": _load_clip_onnx, "blip": _load_blip_onnx, "reranker": _load_reranker_torch},
+}
+if INFERENCE_BACKEND not in _BACKENDS:
+    raise ValueError(f"❌ Unknown INFERENCE_BACKEND '{INFERENCE_BACKEND}', expected one of {list(_BACKENDS)}")
+_LOADERS = _BACKENDS[INFERENCE_BACKEND]
+
+
+def model_tag(name):
+    """
+    Cache-key tag of the "clip" or "blip" model being served: the model name, plus the exact
+    ONNX export (see onnx_backend.export_fingerprint) on the onnx backend.
+    """
+    model_name = {"clip": CLIP_MODEL_NAME, "blip": BLIP_MODEL_NAME}[name]
+    if INFERENCE_BACKEND == "torch":
+        return model_name
+    from src.embedding.onnx_backend import BLIP_FILES, CLIP_FILES, export_fingerprint
+    fingerprint = export_fingerprint(CLIP_FILES if name == "clip" else BLIP_FILES)
+    return f"{model_name}@{INFERENCE_BACKEND}:{fingerprint or 'unexported'}"
+
+
+def uses_onnx():
+    return INFERENCE_BACKEND == "onnx"
+
+
+def tensor_format():
+    """return_tensors value for the processors: numpy for onnxruntime, torch otherwise."""
+    return "np" if uses_onnx() else "pt"
+
+
+def load_torch_model(name):
+    """A fresh, unshared PyTorch (model, processor) for name whatever the backend (export / parity checks)."""
+    return _BACKENDS["torch"][name]()
+
+
+def get_model(name):
+    """
+    Return (model, processor) for name ("clip", "blip" or "reranker"), loading it on first use.
+    All callers in the process share the same instance.
+    """
+    if name not in _LOADERS:
+        raise ValueError(f"❌ Unknown model '{name}', expected one of {list(_LOADERS)}")
+
+    entry = _models.get(name)
+    if entry is None:
+        with _lock:
+            entry = _models.get(name)
+            if entry is None:
+                print(f"⏳ Loading {name.upper()} model...")
+                entry = _LOADERS[name]()
+                _models[name] = entry
+    return entry
+
+
+def get_clip():
+    return get_model("clip")
+
+
+def get_blip():
+    return get_model("blip")
+
+
+def get_reranker():
+    return get_model("reranker")
+
+
+def warm_up(*names):
+    """Load the given models (default: all) ahead of the first request."""
+    for name in names or _LOADERS:
+        get_model(name)
+
+
+def unload(*names):
+    """Drop the given models (default: all) so their memory can be reclaimed."""
+    with _lock:
+        for name in names or list(_models):
+            _models.pop(name, None)
+    gc.collect()
+
+
+def loaded_models():
+    return sorted(_models)
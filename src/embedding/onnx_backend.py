@@ -0,0 +1,289 @@
+# Optional ONNX Runtime backend for CLIP (text + vision towers) and BLIP captioning on CPU:
+# export from the PyTorch models, dynamic int8 quantization and a cosine parity check
+
+import argparse
+import hashlib
+import json
+import os
+from types import SimpleNamespace
+
+import numpy as np
+
+try:
+    import onnxruntime as ort  # optional: only needed for INFERENCE_BACKEND=onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+except ImportError:
+    ort = None
+
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "Dataset/processed_data/onnx")
+ONNX_QUANTIZED = os.getenv("ONNX_QUANTIZED", "1") == "1"  # use the int8 models when exported
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # 0 = onnxruntime default
+
+CLIP_TEXT_FILE = "clip_text.onnx"
+CLIP_VISION_FILE = "clip_vision.onnx"
+BLIP_VISION_FILE = "blip_vision.onnx"
+BLIP_DECODER_FILE = "blip_text_decoder.onnx"
+BLIP_CONFIG_FILE = "blip_config.json"
+CLIP_FILES = (CLIP_TEXT_FILE, CLIP_VISION_FILE)
+BLIP_FILES = (BLIP_VISION_FILE, BLIP_DECODER_FILE)
+
+
+def _require_onnxruntime():
+    if ort is None:
+        raise ImportError("❌ onnxruntime is required for INFERENCE_BACKEND=onnx (pip install onnxruntime onnx)")
+
+
+def _model_path(model_dir, filename, quantized):
+    """The .int8.onnx variant when quantized and present, else the fp32 export."""
+    if quantized:
+        int8_path = os.path.join(model_dir, filename.replace(".onnx", ".int8.onnx"))
+        if os.path.exists(int8_path):
+            return int8_path
+    path = os.path.join(model_dir, filename)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"❌ {path} not found — run `python -m src.embedding.onnx_backend --export` first")
+    return path
+
+
+def export_fingerprint(filenames, model_dir=ONNX_MODEL_DIR, quantized=ONNX_QUANTIZED):
+    """
+    Short id of the exported files the loaders would use (int8 or fp32 variant, size and
+    mtime of each), for cache keys: it changes when ONNX_QUANTIZED is toggled or the models
+    are re-exported. None when the models are not exported yet.
+    """
+    digest = hashlib.sha256()
+    for filename in filenames:
+        try:
+            path = _model_path(model_dir, filename, quantized)
+        except FileNotFoundError:
+            return None
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def _session(path):
+    _require_onnxruntime()
+    options = ort.SessionOptions()
+    if ONNX_THREADS:
+        options.intra_op_num_threads = ONNX_THREADS
+    return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+
+def _normalize(features):
+    return (features / np.linalg.norm(features, axis=-1, keepdims=True)).astype("float32")
+
+
+class OnnxClip:
+    """CLIP text/vision towers on onnxruntime; features come back L2-normalized, as numpy."""
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, quantized=ONNX_QUANTIZED):
+        self.text_session = _session(_model_path(model_dir, CLIP_TEXT_FILE, quantized))
+        self.vision_session = _session(_model_path(model_dir, CLIP_VISION_FILE, quantized))
+        self.config = SimpleNamespace(projection_dim=self.text_session.get_outputs()[0].shape[-1])
+
+    def get_text_features(self, input_ids, attention_mask, **_):
+        feeds = {"input_ids": np.asarray(input_ids, dtype="int64"),
+                 "attention_mask": np.asarray(attention_mask, dtype="int64")}
+        return _normalize(self.text_session.run(None, feeds)[0])
+
+    def get_image_features(self, pixel_values, **_):
+        feeds = {"pixel_values": np.asarray(pixel_values, dtype="float32")}
+        return _normalize(self.vision_session.run(None, feeds)[0])
+
+
+class OnnxBlip:
+    """
+    BLIP captioner on onnxruntime: vision encoder once per image, then greedy decoding
+    with the exported text decoder (the whole prefix is re-run each step; captions are short).
+    """
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, quantized=ONNX_QUANTIZED):
+        self.vision_session = _session(_model_path(model_dir, BLIP_VISION_FILE, quantized))
+        self.decoder_session = _session(_model_path(model_dir, BLIP_DECODER_FILE, quantized))
+        with open(os.path.join(model_dir, BLIP_CONFIG_FILE), "r", encoding="utf-8") as f:
+            self.token_ids = json.load(f)
+
+    def generate(self, pixel_values, max_new_tokens=30, **_):
+        """Greedy decoding only (num_beams / do_sample are accepted and ignored)."""
+        image_embeds = self.vision_session.run(None, {"pixel_values": np.asarray(pixel_values, dtype="float32")})[0]
+        batch_size = image_embeds.shape[0]
+        ids = np.full((batch_size, 1), self.token_ids["bos_token_id"], dtype="int64")
+        finished = np.zeros(batch_size, dtype=bool)
+
+        for _ in range(max_new_tokens):
+            logits = self.decoder_session.run(None, {
+                "input_ids": ids,
+                "attention_mask": np.ones_like(ids),
+                "encoder_hidden_states": image_embeds,
+            })[0]
+            next_ids = logits.argmax(axis=-1)
+            next_ids[finished] = self.token_ids["pad_token_id"]
+            ids = np.concatenate([ids, next_ids[:, None]], axis=1)
+            finished |= next_ids == self.token_ids["eos_token_id"]
+            if finished.all():
+                break
+        return ids
+
+
+def load_onnx_clip():
+    return OnnxClip()
+
+
+def load_onnx_blip():
+    return OnnxBlip()
+
+
+def export_models(output_dir=ONNX_MODEL_DIR, quantize=True, opset=17):
+    """
+    Export the CLIP text/vision towers and the BLIP vision encoder + text decoder to ONNX
+    (dynamic batch / sequence axes) and, with quantize, write dynamic int8 copies
+    (*.int8.onnx; MatMul/Gemm weights only, so convolutions stay fp32 on the CPU provider).
+    """
+    import torch
+    from src.embedding.model_registry import load_torch_model
+
+    _require_onnxruntime()
+    os.makedirs(output_dir, exist_ok=True)
+
+    class ClipText(torch.nn.Module):
+        def __init__(self, clip):
+            super().__init__()
+            self.clip = clip
+
+        def forward(self, input_ids, attention_mask):
+            features = self.clip.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+            return features / features.norm(dim=-1, keepdim=True)
+
+    class ClipVision(torch.nn.Module):
+        def __init__(self, clip):
+            super().__init__()
+            self.clip = clip
+
+        def forward(self, pixel_values):
+            features = self.clip.get_image_features(pixel_values=pixel_values)
+            return features / features.norm(dim=-1, keepdim=True)
+
+    class BlipVision(torch.nn.Module):
+        def __init__(self, blip):
+            super().__init__()
+            self.vision_model = blip.vision_model
+
+        def forward(self, pixel_values):
+            return self.vision_model(pixel_values=pixel_values, return_dict=False)[0]
+
+    class BlipDecoderStep(torch.nn.Module):
+        """Logits of the next token for every sequence in the batch."""
+
+        def __init__(self, blip):
+            super().__init__()
+            self.text_decoder = blip.text_decoder
+
+        def forward(self, input_ids, attention_mask, encoder_hidden_states):
+            logits = self.text_decoder(input_ids=input_ids, attention_mask=attention_mask,
+                                       encoder_hidden_states=encoder_hidden_states, return_dict=False)[0]
+            return logits[:, -1, :]
+
+    clip, clip_processor = load_torch_model("clip")
+    blip, blip_processor = load_torch_model("blip")
+
+    text_inputs = clip_processor(text=["a photo of a product"], return_tensors="pt", padding=True)
+    pixels = clip_processor(images=[np.zeros((224, 224, 3), dtype=np.uint8)], return_tensors="pt")["pixel_values"]
+    blip_pixels = blip_processor(images=[np.zeros((384, 384, 3), dtype=np.uint8)], return_tensors="pt")["pixel_values"]
+    with torch.no_grad():
+        image_embeds = blip.vision_model(pixel_values=blip_pixels, return_dict=False)[0]
+    decoder_ids = torch.tensor([[blip.config.text_config.bos_token_id]], dtype=torch.long)
+
+    exports = [
+        (ClipText(clip), (text_inputs["input_ids"], text_inputs["attention_mask"]), CLIP_TEXT_FILE,
+         ["input_ids", "attention_mask"], {"input_ids": {0: "batch", 1: "seq"}, "attention_mask": {0: "batch", 1: "seq"}}),
+        (ClipVision(clip), (pixels,), CLIP_VISION_FILE, ["pixel_values"], {"pixel_values": {0: "batch"}}),
+        (BlipVision(blip), (blip_pixels,), BLIP_VISION_FILE, ["pixel_values"], {"pixel_values": {0: "batch"}}),
+        (BlipDecoderStep(blip), (decoder_ids, torch.ones_like(decoder_ids), image_embeds), BLIP_DECODER_FILE,
+         ["input_ids", "attention_mask", "encoder_hidden_states"],
+         {"input_ids": {0: "batch", 1: "seq"}, "attention_mask": {0: "batch", 1: "seq"},
+          "encoder_hidden_states": {0: "batch"}}),
+    ]
+    for module, args, filename, input_names, dynamic_axes in exports:
+        path = os.path.join(output_dir, filename)
+        with torch.no_grad():
+            torch.onnx.export(module.eval(), args, path, input_names=input_names, output_names=["output"],
+                              dynamic_axes={**dynamic_axes, "output": {0: "batch"}}, opset_version=opset)
+        if quantize:
+            quantize_dynamic(path, path.replace(".onnx", ".int8.onnx"), weight_type=QuantType.QInt8,
+                             op_types_to_quantize=["MatMul", "Gemm"])
+        print(f"✅ Exported {path}" + (" (+ int8)" if quantize else ""))
+
+    text_config = blip.config.text_config
+    with open(os.path.join(output_dir, BLIP_CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({"bos_token_id": text_config.bos_token_id, "eos_token_id": text_config.sep_token_id,
+                   "pad_token_id": text_config.pad_token_id}, f, indent=1)
+
+
+def _cosines(a, b):
+    return np.sum(_normalize(a) * _normalize(b), axis=-1)
+
+
+def check_parity(texts, image_paths, model_dir=ONNX_MODEL_DIR, quantized=ONNX_QUANTIZED, min_cosine=0.99):
+    """
+    Compare the ONNX backend against the PyTorch models on the same inputs:
+    per-item cosine of CLIP text / image embeddings and of the BLIP vision features
+    (mean-pooled), plus how many greedy captions come out identical.
+    Returns a report dict; "ok" is False if any cosine falls below min_cosine.
+    """
+    import torch
+    from PIL import Image
+    from src.embedding.model_registry import load_torch_model
+
+    clip, clip_processor = load_torch_model("clip")
+    blip, blip_processor = load_torch_model("blip")
+    onnx_clip = OnnxClip(model_dir, quantized)
+    onnx_blip = OnnxBlip(model_dir, quantized)
+    images = [Image.open(p).convert("RGB") for p in image_paths]
+
+    text_inputs = clip_processor(text=texts, return_tensors="pt", padding=True, truncation=True, max_length=77)
+    clip_pixels = clip_processor(images=images, return_tensors="pt")["pixel_values"]
+    blip_pixels = blip_processor(images=images, return_tensors="pt")["pixel_values"]
+    with torch.no_grad():
+        torch_text = clip.get_text_features(**text_inputs).numpy()
+        torch_image = clip.get_image_features(pixel_values=clip_pixels).numpy()
+        torch_blip = blip.vision_model(pixel_values=blip_pixels, return_dict=False)[0].numpy()
+        torch_captions = blip_processor.batch_decode(
+            blip.generate(pixel_values=blip_pixels, max_new_tokens=30, num_beams=1, do_sample=False),
+            skip_special_tokens=True)
+
+    onnx_text = onnx_clip.get_text_features(**{k: v.numpy() for k, v in text_inputs.items()})
+    onnx_image = onnx_clip.get_image_features(clip_pixels.numpy())
+    onnx_blip_features = onnx_blip.vision_session.run(None, {"pixel_values": blip_pixels.numpy()})[0]
+    onnx_captions = blip_processor.batch_decode(onnx_blip.generate(blip_pixels.numpy(), max_new_tokens=30),
+                                                skip_special_tokens=True)
+
+    report = {
+        "clip_text_min_cosine": float(_cosines(torch_text, onnx_text).min()),
+        "clip_image_min_cosine": float(_cosines(torch_image, onnx_image).min()),
+        "blip_vision_min_cosine": float(_cosines(torch_blip.mean(axis=1), onnx_blip_features.mean(axis=1)).min()),
+        "blip_caption_match": sum(a == b for a, b in zip(torch_captions, onnx_captions)) / max(len(images), 1),
+    }
+    report["ok"] = all(v >= min_cosine for k, v in report.items() if k.endswith("cosine"))
+
+    print(f"\n📊 ONNX ({'int8' if quantized else 'fp32'}) vs PyTorch parity")
+    for key, value in report.items():
+        print(f"{key:<24} {value}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export CLIP/BLIP to ONNX and check parity with PyTorch.")
+    parser.add_argument("--export", action="store_true", help="export (and quantize) the models")
+    parser.add_argument("--no-quantize", action="store_true")
+    parser.add_argument("--check", action="store_true", help="compare ONNX and PyTorch outputs")
+    parser.add_argument("--images", default="Dataset/images")
+    parser.add_argument("--output", default=ONNX_MODEL_DIR)
+    args = parser.parse_args()
+
+    if args.export:
+        export_models(args.output, quantize=not args.no_quantize)
+    if args.check:
+        paths = sorted(os.path.join(args.images, p) for p in os.listdir(args.images))[:8]
+        check_parity(["wireless speaker battery drains fast", "projector mount for ceiling", "smartwatch gps"],
+                     paths, args.output, quantized=not args.no_quantize)
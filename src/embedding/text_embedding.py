@@ -1,20 +1,15 @@
 # text embedding using CLIP
 
+import numpy as np
 import torch
-from transformers import CLIPProcessor, CLIPModel
+from src.embedding.model_registry import get_clip, tensor_format, uses_onnx
+from src.embedding.embedding_cache import cached_embed, text_key
 
-clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-
-def embed_text(text, debug=True):
+def embed_text(text, debug=True, use_cache=True):
     """
     Generate text embedding using CLIP.
     """
-    inputs = clip_processor(text=text, return_tensors="pt", padding=True, truncation=True, max_length=77)
-    with torch.no_grad():
-        features = clip_model.get_text_features(**inputs)
-        features = features / features.norm(dim=-1, keepdim=True)
-    embedding = features.squeeze().numpy()
+    embedding = embed_texts([text], use_cache=use_cache)[0]
 
     if debug:
         print(f"\n[DEBUG] Text: {text[:60]}...")
@@ -22,3 +17,39 @@ def embed_text(text, debug=True):
         print(f"Embedding sample: {embedding[:5]}")
 
     return embedding
+
+
+def _embed_text_batches(texts, batch_size=32, debug=False):
+    clip_model, clip_processor = get_clip()
+    batches = []
+    for start in range(0, len(texts), batch_size):
+        batch = list(texts[start:start + batch_size])
+        inputs = clip_processor(text=batch, return_tensors=tensor_format(), padding=True, truncation=True,
+                                max_length=77)
+        if uses_onnx():
+            batches.append(clip_model.get_text_features(**inputs))  # already normalized
+        else:
+            with torch.no_grad():
+                features = clip_model.get_text_features(**inputs)
+                features = features / features.norm(dim=-1, keepdim=True)
+            batches.append(features.numpy())
+
+        if debug:
+            print(f"[DEBUG] Embedded text batch {start // batch_size + 1} ({len(batch)} texts)")
+
+    if not batches:
+        return np.zeros((0, clip_model.config.projection_dim), dtype="float32")
+    return np.concatenate(batches).astype("float32")
+
+
+def embed_texts(texts, batch_size=32, debug=False, use_cache=True):
+    """
+    Generate CLIP text embeddings for a list of texts, batch_size texts per forward pass.
+    Returns a float32 array of shape (len(texts), dim).
+    With use_cache, texts embedded before (same model, same text) are read from the
+    persistent embedding cache and only the rest go through CLIP.
+    """
+    if not use_cache or not len(texts):
+        return _embed_text_batches(texts, batch_size, debug)
+    return cached_embed([text_key(t) for t in texts], texts,
+                        lambda batch: _embed_text_batches(batch, batch_size, debug), "text")
@@ -0,0 +1,167 @@
+# Recall vs latency of the approximate / quantized FAISS index types against the exact flat baseline
+
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from src.vector_space.index_factory import build_index, set_search_params
+from src.vector_space.multimodal_store import rescore
+
+# index_type -> list of query-time settings to sweep
+DEFAULT_SWEEP = {
+    "ivf_flat": [{"nprobe": n} for n in (1, 4, 16, 64)],
+    "ivf_pq": [{"nprobe": n} for n in (1, 4, 16, 64)],
+    "hnsw": [{"ef_search": ef} for ef in (16, 64, 256)],
+}
+
+DEFAULT_QUANTIZATION = ("sq_fp16", "sq_int8", "binary")
+DEFAULT_RESCORE_FACTORS = (0, 2, 4, 10)  # 0 = raw quantized ranking, no rescoring
+
+
+def _timed_search(index, queries, k):
+    start = time.perf_counter()
+    _, ids = index.search(queries, k)
+    return ids, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def recall_at_k(truth_ids, found_ids):
+    """Mean fraction of the exact top-k neighbours that the approximate search also returned."""
+    k = truth_ids.shape[1]
+    hits = [len(set(t) & set(f)) for t, f in zip(truth_ids, found_ids)]
+    return float(np.mean(hits)) / k
+
+
+def held_out_split(vectors, n_queries, seed=0):
+    """
+    (indexed vectors, query vectors): n_queries vectors sampled as queries and left out of
+    the indexed set. Querying with indexed vectors makes every query its own exact nearest
+    neighbour, which inflates the recall of approximate indexes.
+    """
+    n_queries = min(n_queries, len(vectors) - 1)
+    rng = np.random.default_rng(seed)
+    is_query = np.zeros(len(vectors), dtype=bool)
+    is_query[rng.choice(len(vectors), n_queries, replace=False)] = True
+    return vectors[~is_query], vectors[is_query]
+
+
+def _warn_if_self_queries(flat, queries):
+    """Warn when most queries are themselves indexed vectors (see held_out_split)."""
+    distances, _ = flat.search(queries, 1)
+    share = float(np.mean(distances[:, 0] < 1e-6))
+    if share > 0.5:
+        print(f"⚠️ Warning: {share:.0%} of the queries are indexed vectors — recall is overstated, "
+              f"use held-out queries (held_out_split)")
+
+
+def benchmark_index_types(embeddings, queries, k=10, sweep=None, build_params=None, debug=False):
+    """
+    Build every index type in sweep on embeddings, run queries at each search setting and
+    report recall@k against IndexFlatL2 plus mean per-query latency.
+    queries should not be part of embeddings (held_out_split, or embedded real queries).
+    Returns a list of result dicts (the flat baseline first).
+    """
+    sweep = sweep or DEFAULT_SWEEP
+    build_params = build_params or {}
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    queries = np.ascontiguousarray(queries, dtype="float32")
+
+    flat = build_index(embeddings, "flat")
+    _warn_if_self_queries(flat, queries)
+    truth, flat_ms = _timed_search(flat, queries, k)
+    results = [{"index_type": "flat", "params": {}, "recall": 1.0, "latency_ms": flat_ms, "build_s": 0.0}]
+
+    for index_type, settings in sweep.items():
+        start = time.perf_counter()
+        index = build_index(embeddings, index_type, debug=debug, **build_params.get(index_type, {}))
+        build_s = time.perf_counter() - start
+        for params in settings:
+            set_search_params(index, **params)
+            found, ms = _timed_search(index, queries, k)
+            results.append({"index_type": index_type, "params": params, "recall": recall_at_k(truth, found),
+                            "latency_ms": ms, "build_s": build_s})
+
+    print(f"\n📊 Recall@{k} vs latency ({len(embeddings)} vectors, {len(queries)} queries)")
+    print(f"{'index':<10} {'params':<18} {'recall':>8} {'ms/query':>10} {'build s':>9}")
+    for r in results:
+        params = ", ".join(f"{k}={v}" for k, v in r["params"].items()) or "-"
+        print(f"{r['index_type']:<10} {params:<18} {r['recall']:>8.3f} {r['latency_ms']:>10.3f} {r['build_s']:>9.2f}")
+    return results
+
+
+def _rescored_search(index, embeddings, queries, k, rescore_factor):
+    start = time.perf_counter()
+    if not rescore_factor:
+        _, ids = index.search(queries, k)
+    else:
+        _, shortlists = index.search(queries, k * rescore_factor)
+        ids = np.full((len(queries), k), -1, dtype="int64")
+        for row, (q, shortlist) in enumerate(zip(queries, shortlists)):
+            shortlist = [int(i) for i in shortlist if i != -1]
+            hits = [i for i, _ in rescore(q, shortlist, embeddings[shortlist], k)]
+            ids[row, :len(hits)] = hits
+    return ids, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def benchmark_quantization(embeddings, queries, k=10, index_types=DEFAULT_QUANTIZATION,
+                           rescore_factors=DEFAULT_RESCORE_FACTORS, debug=False):
+    """
+    Build every quantized index type on embeddings and report, per shortlist size
+    (k * rescore_factor, rescored on the float32 embeddings), recall@k against the float32
+    IndexFlatL2, mean per-query latency and the serialized index size.
+    queries should not be part of embeddings (held_out_split, or embedded real queries).
+    Returns a list of result dicts (the flat baseline first).
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    queries = np.ascontiguousarray(queries, dtype="float32")
+
+    flat = build_index(embeddings, "flat")
+    _warn_if_self_queries(flat, queries)
+    truth, flat_ms = _timed_search(flat, queries, k)
+    flat_bytes = faiss.serialize_index(flat).nbytes
+    results = [{"index_type": "flat", "rescore_factor": 0, "recall": 1.0, "latency_ms": flat_ms,
+                "bytes": flat_bytes}]
+
+    for index_type in index_types:
+        index = build_index(embeddings, index_type, debug=debug)
+        size = faiss.serialize_index(index).nbytes
+        for factor in rescore_factors:
+            found, ms = _rescored_search(index, embeddings, queries, k, factor)
+            results.append({"index_type": index_type, "rescore_factor": factor, "recall": recall_at_k(truth, found),
+                            "latency_ms": ms, "bytes": size})
+
+    print(f"\n📊 Quantization: recall@{k} vs float32 flat ({len(embeddings)} vectors, {len(queries)} queries)")
+    print(f"{'index':<10} {'rescore':>8} {'recall':>8} {'ms/query':>10} {'MB':>8} {'vs flat':>8}")
+    for r in results:
+        factor = f"x{r['rescore_factor']}" if r["rescore_factor"] else "-"
+        print(f"{r['index_type']:<10} {factor:>8} {r['recall']:>8.3f} {r['latency_ms']:>10.3f} "
+              f"{r['bytes'] / 1e6:>8.2f} {r['bytes'] / flat_bytes:>8.2f}")
+    return results
+
+
+def load_index_vectors(index_path):
+    """Read back the raw vectors of a flat (text or image) index built by build_faiss_index."""
+    index = faiss.read_index(index_path)
+    # keep the IndexIDMap wrapper alive while using the index it owns
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if not isinstance(faiss.downcast_index(inner), faiss.IndexFlat):
+        raise ValueError("❌ Benchmark needs the exact vectors — point it at a flat index.")
+    return inner.reconstruct_n(0, inner.ntotal)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare ANN and quantized index types against the flat baseline.")
+    parser.add_argument("--index", default="Dataset/processed_data/faiss.index")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200, help="vectors held out of the index as queries")
+    parser.add_argument("--query-vectors", help=".npy of embedded real queries (the whole index is then searched)")
+    args = parser.parse_args()
+
+    vectors = load_index_vectors(args.index)
+    if args.query_vectors:
+        queries = np.load(args.query_vectors)
+    else:
+        vectors, queries = held_out_split(vectors, args.queries)
+    benchmark_index_types(vectors, queries, k=min(args.k, len(vectors)))
+    benchmark_quantization(vectors, queries, k=min(args.k, len(vectors)))
@@ -0,0 +1,109 @@
+# Persistent BLIP caption cache keyed by the image content hash
+
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+
+from src.embedding.model_registry import model_tag
+from src.ingestion.process_image import preprocess_image, preprocess_images, CAPTION_BATCH_SIZE
+
+MODEL_TAG = model_tag("blip")  # includes the ONNX export in use, so variants never share entries
+
+CAPTION_CACHE_PATH = os.getenv("CAPTION_CACHE_PATH", "Dataset/processed_data/caption_cache.sqlite")
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _connection():
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(CAPTION_CACHE_PATH), exist_ok=True)
+        # parallel build workers share the file, so wait for each other's writes instead of failing
+        _conn = sqlite3.connect(CAPTION_CACHE_PATH, check_same_thread=False, timeout=30)
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS captions (key TEXT PRIMARY KEY, caption TEXT NOT NULL)"
+        )
+        _conn.commit()
+    return _conn
+
+
+def image_key(data: bytes) -> str:
+    """Cache key: captioning model + sha256 of the image bytes."""
+    return f"{MODEL_TAG}:{hashlib.sha256(data).hexdigest()}"
+
+
+def get_caption(key):
+    with _lock:
+        row = _connection().execute("SELECT caption FROM captions WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def put_caption(key, caption):
+    with _lock:
+        conn = _connection()
+        conn.execute("INSERT OR REPLACE INTO captions (key, caption) VALUES (?, ?)", (key, caption))
+        conn.commit()
+
+
+def caption_image(image_path, debug=False):
+    """
+    Return the BLIP caption for image_path, generating it only if these exact bytes
+    have never been captioned before.
+    """
+    with open(image_path, "rb") as f:
+        key = image_key(f.read())
+
+    caption = get_caption(key)
+    if caption is None:
+        caption = preprocess_image(image_path, debug=debug)
+        put_caption(key, caption)
+    elif debug:
+        print(f"\n[DEBUG] Cached caption for {image_path}: {caption}")
+
+    return caption
+
+
+def caption_image_data(data: bytes, image=None, debug=False):
+    """
+    caption_image for an image already in memory: data are its bytes (the cache key) and
+    image, when given, the decoded PIL image, so a cache miss does not decode it again.
+    """
+    key = image_key(data)
+    caption = get_caption(key)
+    if caption is None:
+        caption = preprocess_images([image if image is not None else io.BytesIO(data)], debug=debug)[0]
+        put_caption(key, caption)
+    elif debug:
+        print(f"\n[DEBUG] Cached caption for uploaded image: {caption}")
+
+    return caption
+
+
+def caption_images(image_paths, batch_size=CAPTION_BATCH_SIZE, debug=False):
+    """
+    Batch version of caption_image: captions are read from the cache where possible and
+    the remaining images (each distinct content once) are captioned batch_size at a time.
+    Returns the captions in input order.
+    """
+    keys = []
+    for path in image_paths:
+        with open(path, "rb") as f:
+            keys.append(image_key(f.read()))
+
+    captions = {key: get_caption(key) for key in keys}
+    missing = {}
+    for key, path in zip(keys, image_paths):
+        if captions[key] is None:
+            missing.setdefault(key, path)
+
+    if missing:
+        for key, caption in zip(missing, preprocess_images(list(missing.values()), batch_size, debug=debug)):
+            put_caption(key, caption)
+            captions[key] = caption
+    if debug:
+        print(f"[DEBUG] Captions: {len(keys) - len(missing)} cached, {len(missing)} generated")
+
+    return [captions[key] for key in keys]
@@ -1,9 +1,25 @@
 #load and chunk JSON product data with image paths for multimodal retrieval
 
 import json
+import hashlib
+import sqlite3
+from collections import Counter
+from itertools import islice
 from pathlib import Path
 from langchain.docstore.document import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from src.ingestion.caption_cache import caption_image
+from src.ingestion.load_parquet_and_chunk import AMAZON_FIELDS, amazon_document, iter_parquet_documents
+from src.ingestion.precompute_captions import load_catalog_captions, catalog_caption
+
+try:
+    import ijson  # optional: incremental parsing of large JSON arrays
+except ImportError:
+    ijson = None
+
+CATALOG_PATTERNS = ("*.json", "*.jsonl", "*.parquet")
+# Metadata keys of every chunk (part of the product hash, so adding one re-chunks the catalog once)
+CHUNK_METADATA_FIELDS = ("asin", "product_name", "category", "image_path", "source_file")
 
 def _stringify_specifications(spec):
     """Turn specs (possibly a dict) into a readable string."""
@@ -30,71 +46,305 @@ def _product_iter(obj):
         # unsupported root type
         return
 
-def load_json_data(json_folder, chunk_size=300, chunk_overlap=50, debug=True):
+def catalog_files(json_folder):
+    """Catalog files of a folder (JSON, JSONL, Parquet) in a stable order."""
+    return sorted(p for pattern in CATALOG_PATTERNS for p in Path(json_folder).glob(pattern))
+
+def _first_char(f):
+    """First non-whitespace character of the file (the file position is restored)."""
+    pos = f.tell()
+    while True:
+        block = f.read(4096)
+        if not block:
+            f.seek(pos)
+            return ""
+        stripped = block.lstrip()
+        if stripped:
+            f.seek(pos)
+            return stripped[0]
+
+def _is_json_lines(f):
+    """True if the first line is a complete JSON object on its own (JSONL / concatenated records)."""
+    pos = f.tell()
+    first_line = f.readline()
+    f.seek(pos)
+    try:
+        return isinstance(json.loads(first_line), dict)
+    except ValueError:
+        return False
+
+def iter_products(json_file):
+    """
+    Yield product dicts from one catalog file without loading the whole file:
+      - JSON Lines (.jsonl, or .json with one object per line): parsed line by line
+      - JSON array: parsed item by item with ijson when installed
+      - single JSON object (or array without ijson): json.load
+    """
+    with open(json_file, "r", encoding="utf-8") as f:
+        first = _first_char(f)
+        if first == "{" and _is_json_lines(f):
+            for line in f:
+                if line.strip():
+                    yield from _product_iter(json.loads(line))
+        elif first == "[" and ijson is not None:
+            with open(json_file, "rb") as fb:
+                for product in ijson.items(fb, "item", use_float=True):
+                    if isinstance(product, dict):
+                        yield product
+        elif first:
+            yield from _product_iter(json.load(f))
+
+def iter_batches(iterable, batch_size):
+    """Yield lists of up to batch_size items from any iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def _caption_for(image_path, captions, debug=False):
+    """
+    Caption for a catalog image: the precomputed one (precompute_captions) if there is one,
+    else BLIP through the caption cache, or "" when the image is missing or captioning fails.
+    Caption cache errors (e.g. "database is locked") are raised: an empty caption would be indexed.
+    """
+    caption = catalog_caption(captions, image_path)
+    if caption is not None:
+        return caption
+    if not image_path or not Path(image_path).exists():
+        return ""
+    try:
+        return caption_image(image_path, debug=debug)
+    except sqlite3.Error:
+        raise
+    except Exception as e:
+        print(f"⚠️ Warning: Captioning failed for {image_path}: {e}")
+        return ""
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _product_hash(product, chunk_size, chunk_overlap):
+    """Changes whenever the product JSON, the chunking settings or the chunk metadata fields change."""
+    payload = json.dumps([product, chunk_size, chunk_overlap, CHUNK_METADATA_FIELDS], sort_keys=True,
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def product_key(json_file, product, position, occurrence=0):
+    """
+    Stable id of a product across runs: source file + ASIN (or position when there is no ASIN).
+    occurrence counts earlier products of the same file with the same ASIN, so repeated ASINs get distinct keys.
+    """
+    key = f"{json_file}::{product.get('asin') or f'#{position}'}"
+    return f"{key}~{occurrence}" if occurrence else key
+
+# Keys of the support-catalog schema (Dataset/text-data_json)
+SUPPORT_FIELDS = ("name", "description", "image_url", "support_data")
+
+def _product_document(product, json_file):
+    """
+    Build the (unsplit) product text with the product metadata. Records in the Amazon
+    schema (title, img_url, feature-bullets, tech_data) are mapped like Parquet rows;
+    records matching neither schema raise ValueError.
+    """
+    if not any(key in product for key in SUPPORT_FIELDS):
+        if any(key in product for key in AMAZON_FIELDS):
+            return amazon_document(product, json_file)
+        raise ValueError(f"❌ {json_file}: product {product.get('asin', '?')} matches no known catalog schema "
+                         f"(expected {SUPPORT_FIELDS} or {AMAZON_FIELDS})")
+
+    asin = product.get("asin", "")
+    name = product.get("name", "Unknown")
+    category = product.get("category", "Unknown")
+    description = product.get("description", "")
+
+    support_data = product.get("support_data", {}) or {}
+    common_issues = support_data.get("common_issues", []) or []
+    steps = support_data.get("troubleshooting_steps", []) or []
+    warranty = support_data.get("warranty", "")
+    specifications = _stringify_specifications(support_data.get("specifications", {}))
+
+    image_path = product.get("image_url", "")  # expected to be a local path
+
+    product_text = (
+        f"Product: {name} ({asin})\n"
+        f"Category: {category}\n"
+        f"Description: {description}\n"
+        f"Common Issues: {', '.join(common_issues)}\n"
+        f"Troubleshooting: {', '.join(steps)}\n"
+        f"Warranty: {warranty}\n"
+        f"Specifications: {specifications}\n"
+    )
+
+    metadata = {
+        "asin": asin,
+        "product_name": name,
+        "category": category,
+        "image_path": image_path,
+        "source_file": str(json_file)
+    }
+    return Document(page_content=product_text, metadata=metadata)
+
+def iter_catalog_products(catalog_file, chunk_size=300, chunk_overlap=50):
+    """
+    Yield (product_key, content_hash, document) for every product of a catalog file.
+    .parquet files are read column-wise in record batches (load_parquet_and_chunk);
+    JSON / JSONL files product by product.
+    """
+    occurrences = Counter()
+
+    def key_of(product, position):
+        asin = product.get("asin")
+        occurrence = occurrences[asin] if asin else 0
+        occurrences[asin] += 1
+        return product_key(catalog_file, product, position, occurrence)
+
+    if Path(catalog_file).suffix == ".parquet":
+        for position, doc in enumerate(iter_parquet_documents(catalog_file)):
+            yield (key_of(doc.metadata, position),
+                   _product_hash([doc.page_content, doc.metadata], chunk_size, chunk_overlap), doc)
+        return
+
+    for position, product in enumerate(iter_products(catalog_file)):
+        yield (key_of(product, position),
+               _product_hash(product, chunk_size, chunk_overlap), _product_document(product, catalog_file))
+
+def _split_product(doc, splitter, captions=None, debug=False):
+    """
+    Split a product document into chunks that all carry the product metadata.
+    captions ({file name: caption}, possibly empty) enables image captioning; None skips it.
+    """
+    image_path = doc.metadata["image_path"]
+    if captions is not None:
+        doc.metadata["image_caption"] = _caption_for(image_path, captions, debug=debug)
+
+    chunks = splitter.split_documents([doc])
+
+    for chunk in chunks:
+        # Ensure image path is attached to each chunk of this product
+        chunk.metadata["image_path"] = image_path
+    return chunks
+
+def _tag_chunks(chunks, key, content_hash, file_hash):
+    """Record which product (and which version of it) each chunk came from, for incremental updates."""
+    for chunk in chunks:
+        chunk.metadata["product_key"] = key
+        chunk.metadata["content_hash"] = content_hash
+        chunk.metadata["file_hash"] = file_hash
+    return chunks
+
+def _print_chunks(chunks):
+    print("\n[DEBUG] Loaded Chunks:")
+    for i, c in enumerate(chunks, start=1):
+        print(f"\n--- Chunk {i} ---")
+        print(c.page_content)
+        print(f"Metadata: {c.metadata}")
+
+def iter_json_chunks(json_folder, chunk_size=300, chunk_overlap=50, debug=True, caption_images=True):
+    """
+    Generator version of load_json_data: parses the catalog files product by product and
+    yields chunks as they are produced, so memory does not grow with the catalog size.
+    """
+    yield from iter_catalog_chunks(catalog_files(json_folder), chunk_size, chunk_overlap, debug, caption_images)
+
+def iter_catalog_chunks(files, chunk_size=300, chunk_overlap=50, debug=True, caption_images=True, shard=None):
+    """
+    Same as iter_json_chunks for an explicit list of catalog files.
+    shard=(i, n) keeps only every n-th product starting at the i-th (counted across all
+    files), so n build workers can split one catalog between them.
+    """
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+    captions = load_catalog_captions() if caption_images else None
+    position = -1
+
+    for json_file in files:
+        if debug:
+            print(f"\n[DEBUG] Reading catalog file: {json_file}")
+
+        file_hash = _file_hash(json_file)
+
+        # Iterate products regardless of whether file has a dict, list, one product per line or is Parquet
+        for key, content_hash, doc in iter_catalog_products(json_file, chunk_size, chunk_overlap):
+            position += 1
+            if shard and position % shard[1] != shard[0]:
+                continue
+            chunks = _tag_chunks(_split_product(doc, splitter, captions, debug), key, content_hash, file_hash)
+            if debug:
+                _print_chunks(chunks)
+            yield from chunks
+
+def load_json_data(json_folder, chunk_size=300, chunk_overlap=50, debug=True, caption_images=True):
     """
     Load JSON files, create semantic chunks, and associate product image path.
     Supports:
       - One product per file (dict)
       - Multiple products per file (list[dict])
+      - JSON Lines (one product per line)
+      - Parquet files with the Amazon product schema (asin, title, img_url, feature-bullets, tech_data)
+    With caption_images, each product image gets a caption stored as "image_caption" in the
+    chunk metadata, so queries never run BLIP on it: the one precomputed for its file name by
+    precompute_captions if available, otherwise BLIP through the caption cache.
+    Every chunk also carries product_key / content_hash / file_hash for load_json_delta.
+    For large catalogs use iter_json_chunks, which yields the same chunks lazily.
     """
-    all_chunks = []
+    return list(iter_json_chunks(json_folder, chunk_size, chunk_overlap, debug, caption_images))
+
+def load_json_delta(json_folder, manifest, chunk_size=300, chunk_overlap=50, debug=True, caption_images=True):
+    """
+    Compare the catalog files against the manifest of the current index and chunk only what changed.
+    Files whose hash is unchanged are not parsed; inside changed files only products whose
+    content hash differs are re-chunked.
+    Returns (chunks, removed_keys, file_hashes):
+      chunks       – chunks of new or changed products
+      removed_keys – product keys whose old chunks must leave the index (changed or deleted)
+      file_hashes  – current {source_file: hash} for every catalog file
+    """
+    known_files = manifest.get("files", {})
+    known_products = manifest.get("products", {})
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+
+    captions = load_catalog_captions() if caption_images else None
+    chunks, removed_keys, file_hashes = [], [], {}
+    for json_file in catalog_files(json_folder):
+        file_hash = _file_hash(json_file)
+        file_hashes[str(json_file)] = file_hash
+        if known_files.get(str(json_file)) == file_hash:
+            continue
 
-    for json_file in Path(json_folder).glob("*.json"):
         if debug:
-            print(f"\n[DEBUG] Reading JSON file: {json_file}")
-
-        with open(json_file, "r", encoding="utf-8") as f:
-            root = json.load(f)
-
-        # Iterate products regardless of whether file has a dict or list
-        for product in _product_iter(root):
-            asin = product.get("asin", "")
-            name = product.get("name", "Unknown")
-            category = product.get("category", "Unknown")
-            description = product.get("description", "")
-
-            support_data = product.get("support_data", {}) or {}
-            common_issues = support_data.get("common_issues", []) or []
-            steps = support_data.get("troubleshooting_steps", []) or []
-            warranty = support_data.get("warranty", "")
-            specifications = _stringify_specifications(support_data.get("specifications", {}))
-
-            image_path = product.get("image_url", "")  # expected to be a local path
-
-            product_text = (
-                f"Product: {name} ({asin})\n"
-                f"Category: {category}\n"
-                f"Description: {description}\n"
-                f"Common Issues: {', '.join(common_issues)}\n"
-                f"Troubleshooting: {', '.join(steps)}\n"
-                f"Warranty: {warranty}\n"
-                f"Specifications: {specifications}\n"
-            )
-
-            metadata = {
-                "asin": asin,
-                "product_name": name,
-                "image_path": image_path,
-                "source_file": str(json_file)
-            }
-
-            splitter = RecursiveCharacterTextSplitter(
-                chunk_size=chunk_size,
-                chunk_overlap=chunk_overlap
-            )
-            temp_doc = Document(page_content=product_text, metadata=metadata)
-            chunks = splitter.split_documents([temp_doc])
-
-            for chunk in chunks:
-                # Ensure image path is attached to each chunk of this product
-                chunk.metadata["image_path"] = image_path
-                all_chunks.append(chunk)
+            print(f"\n[DEBUG] Changed catalog file: {json_file}")
+
+        seen = set()
+        for key, content_hash, doc in iter_catalog_products(json_file, chunk_size, chunk_overlap):
+            seen.add(key)
+            known = known_products.get(key)
+            if known and known["hash"] == content_hash:
+                continue
+            if known:
+                removed_keys.append(key)
+            product_chunks = _split_product(doc, splitter, captions, debug)
+            chunks.extend(_tag_chunks(product_chunks, key, content_hash, file_hash))
+
+        # Products that disappeared from a changed file
+        removed_keys.extend(key for key, info in known_products.items()
+                            if info["source_file"] == str(json_file) and key not in seen)
+
+    # Products of deleted files
+    removed_keys.extend(key for key, info in known_products.items() if info["source_file"] not in file_hashes)
 
     if debug:
-        print("\n[DEBUG] Loaded Chunks:")
-        for i, c in enumerate(all_chunks, start=1):
-            print(f"\n--- Chunk {i} ---")
-            print(c.page_content)
-            print(f"Metadata: {c.metadata}")
+        print(f"\n[DEBUG] Delta: {len(chunks)} new chunks, {len(removed_keys)} products to remove")
+        _print_chunks(chunks)
 
-    return all_chunks
+    return chunks, removed_keys, file_hashes
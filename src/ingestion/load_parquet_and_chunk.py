@@ -0,0 +1,115 @@
+#load Parquet product data (Amazon schema) column-wise and turn it into product documents
+
+from langchain.docstore.document import Document
+
+try:
+    import pyarrow as pa  # optional: only needed for *.parquet catalogs
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = pq = None
+
+# Columns of data_raw/validation-*.parquet that end up in the product text / metadata
+PARQUET_COLUMNS = ["asin", "category", "img_url", "title", "feature-bullets", "tech_data"]
+PARQUET_BATCH_SIZE = 1024
+# Keys that mark a JSON / JSONL record as the same Amazon schema (e.g. data_raw/amazon_product_data.json)
+AMAZON_FIELDS = ("title", "img_url", "feature-bullets", "tech_data")
+
+
+def _require_pyarrow():
+    if pq is None:
+        raise ImportError("❌ pyarrow is required to ingest .parquet catalogs (pip install pyarrow)")
+
+
+def _column(batch, name):
+    """String column with nulls replaced by "" (all-empty if the file lacks the column)."""
+    if name not in batch.schema.names:
+        return pa.array([""] * batch.num_rows, type=pa.string())
+    return pc.fill_null(batch.column(name), "")
+
+
+def _join_list(values, sep):
+    """list<string> column -> string column, items joined by sep."""
+    return pc.fill_null(pc.binary_join(values, sep), "")
+
+
+def _spec_lists(tech_data):
+    """tech_data (list of [key, value] pairs) -> list<string> of "key: value" per product."""
+    pair_text = pc.binary_join(pc.list_flatten(tech_data), ": ")
+    offsets = pc.subtract(tech_data.offsets, tech_data.offsets[0])
+    return pa.ListArray.from_arrays(offsets, pair_text, mask=tech_data.is_null())
+
+
+def product_texts(batch):
+    """
+    Build the product text of every row of a record batch with Arrow compute kernels
+    (no per-row Python): same layout as the JSON product text.
+    """
+    if "feature-bullets" in batch.schema.names:
+        features = _join_list(batch.column("feature-bullets"), "; ")
+    else:
+        features = _column(batch, "feature-bullets")
+    if "tech_data" in batch.schema.names:
+        specifications = _join_list(_spec_lists(batch.column("tech_data")), ", ")
+    else:
+        specifications = _column(batch, "tech_data")
+
+    return pc.binary_join_element_wise(
+        "Product: ", _column(batch, "title"), " (", _column(batch, "asin"), ")\n",
+        "Category: ", _column(batch, "category"), "\n",
+        "Features: ", features, "\n",
+        "Specifications: ", specifications, "\n",
+        "",  # separator
+    )
+
+
+def iter_parquet_batches(parquet_file, batch_size=PARQUET_BATCH_SIZE):
+    """Read only the product columns, batch_size rows at a time."""
+    _require_pyarrow()
+    pf = pq.ParquetFile(parquet_file)
+    columns = [c for c in PARQUET_COLUMNS if c in pf.schema_arrow.names]
+    yield from pf.iter_batches(batch_size=batch_size, columns=columns)
+
+
+def amazon_metadata(asin, title, category, image, source_file):
+    """Chunk metadata of an Amazon-schema product (same keys as the JSON loader)."""
+    return {
+        "asin": asin,
+        "product_name": title or "Unknown",
+        "category": category or "Unknown",
+        "image_path": image,
+        "source_file": str(source_file)
+    }
+
+
+def amazon_document(record, source_file):
+    """
+    Document of one Amazon-schema record read from JSON / JSONL: the same text and
+    metadata iter_parquet_documents builds for a Parquet row.
+    """
+    features = "; ".join(str(f) for f in record.get("feature-bullets") or [])
+    specifications = ", ".join(": ".join(str(x) for x in pair) for pair in record.get("tech_data") or [])
+    asin, title, category = record.get("asin") or "", record.get("title") or "", record.get("category") or ""
+    text = (
+        f"Product: {title} ({asin})\n"
+        f"Category: {category}\n"
+        f"Features: {features}\n"
+        f"Specifications: {specifications}\n"
+    )
+    return Document(page_content=text,
+                    metadata=amazon_metadata(asin, title, category, record.get("img_url") or "", source_file))
+
+
+def iter_parquet_documents(parquet_file, batch_size=PARQUET_BATCH_SIZE):
+    """
+    Yield one unsplit Document per product row, with the same metadata keys as the
+    JSON loader (asin, product_name, category, image_path, source_file).
+    """
+    for batch in iter_parquet_batches(parquet_file, batch_size):
+        texts = product_texts(batch).to_pylist()
+        asins = _column(batch, "asin").to_pylist()
+        titles = _column(batch, "title").to_pylist()
+        categories = _column(batch, "category").to_pylist()
+        images = _column(batch, "img_url").to_pylist()
+        for text, asin, title, category, image in zip(texts, asins, titles, categories, images):
+            yield Document(page_content=text, metadata=amazon_metadata(asin, title, category, image, parquet_file))
@@ -0,0 +1,59 @@
+# Offline job: caption every catalog image once and store {file name: caption} for ingestion
+
+import argparse
+import json
+import os
+from pathlib import Path, PureWindowsPath
+
+from src.ingestion.caption_cache import caption_images
+from src.ingestion.process_image import CAPTION_BATCH_SIZE
+
+CATALOG_IMAGES_DIR = "Dataset/images"
+CATALOG_CAPTIONS_PATH = "Dataset/processed_data/image_captions.json"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def precompute_captions(images_dir=CATALOG_IMAGES_DIR, output_path=CATALOG_CAPTIONS_PATH,
+                        batch_size=CAPTION_BATCH_SIZE, debug=False):
+    """
+    Caption all images in images_dir in batches (through the caption cache, so reruns only
+    caption new or changed files) and write {file name: caption} to output_path.
+    load_json_data puts these captions into the chunk metadata of products whose image has
+    the same file name; products chunked before the job ran pick them up on their next rebuild.
+    """
+    paths = sorted(p for p in Path(images_dir).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    captions = dict(zip((p.name for p in paths), caption_images([str(p) for p in paths], batch_size, debug=debug)))
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(captions, f, indent=1, ensure_ascii=False)
+    os.replace(tmp_path, output_path)
+
+    print(f"✅ Captioned {len(captions)} images from {images_dir} into {output_path}")
+    return captions
+
+
+def load_catalog_captions(path=CATALOG_CAPTIONS_PATH):
+    """{file name: caption} written by precompute_captions ({} if the job has not run)."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def catalog_caption(captions, image_path):
+    """Precomputed caption for a catalog image path (Windows or POSIX style), or None."""
+    if not image_path:
+        return None
+    return captions.get(PureWindowsPath(image_path).name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Caption every catalog image once with BLIP.")
+    parser.add_argument("--images", default=CATALOG_IMAGES_DIR)
+    parser.add_argument("--output", default=CATALOG_CAPTIONS_PATH)
+    parser.add_argument("--batch-size", type=int, default=CAPTION_BATCH_SIZE)
+    args = parser.parse_args()
+
+    precompute_captions(args.images, args.output, args.batch_size, debug=True)
@@ -1,26 +1,46 @@
 #process images to generate captions for multimodal retrieval
 
-from PIL import Image
+import os
 import numpy as np
-from transformers import BlipProcessor, BlipForConditionalGeneration
+from src.embedding.model_registry import get_blip, tensor_format
+from src.utils.uploads import to_rgb
 
-# Load BLIP model once
-processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
+# Bounded, deterministic decoding: greedy search with a cap on the caption length
+CAPTION_MAX_NEW_TOKENS = int(os.getenv("CAPTION_MAX_NEW_TOKENS", "30"))
+CAPTION_BATCH_SIZE = int(os.getenv("CAPTION_BATCH_SIZE", "8"))
 
-def preprocess_image(image_path, debug=True):
+
+def preprocess_image(image_path, debug=True, max_new_tokens=CAPTION_MAX_NEW_TOKENS):
     """
     Generate a caption for an image using BLIP (for LLM context).
     """
-    img = Image.open(image_path).convert("RGB")
-
-    # Generate caption
-    inputs = processor(img, return_tensors="pt")
-    out = model.generate(**inputs)
-    caption = processor.decode(out[0], skip_special_tokens=True)
+    caption = preprocess_images([image_path], max_new_tokens=max_new_tokens)[0]
 
     if debug:
         print(f"\n[DEBUG] Processed image from: {image_path}")
         print(f"[DEBUG] Image caption: {caption}")
 
     return caption
+
+
+def preprocess_images(images, batch_size=CAPTION_BATCH_SIZE, max_new_tokens=CAPTION_MAX_NEW_TOKENS, debug=False):
+    """
+    Caption a list of images (PIL images, paths or file objects) with BLIP, batch_size images per
+    generate() call, using greedy decoding and at most max_new_tokens tokens per caption.
+    Returns the captions in input order.
+    """
+    model, processor = get_blip()
+    captions = []
+    for start in range(0, len(images), batch_size):
+        batch = list(images[start:start + batch_size])
+        imgs = [to_rgb(p) for p in batch]
+
+        # Generate captions
+        inputs = processor(images=imgs, return_tensors=tensor_format())
+        out = model.generate(**inputs, max_new_tokens=max_new_tokens, num_beams=1, do_sample=False)
+        captions.extend(processor.batch_decode(out, skip_special_tokens=True))
+
+        if debug:
+            print(f"[DEBUG] Captioned image batch {start // batch_size + 1} ({len(batch)} images)")
+
+    return captions
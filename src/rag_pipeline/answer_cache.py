@@ -0,0 +1,106 @@
+# Semantic answer cache: reuse LLM answers for (near-)identical questions
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.97"))  # cosine similarity
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1024"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))  # seconds
+
+
+class SemanticAnswerCache:
+    """
+    Maps query embeddings to answers. A lookup hits when a cached query vector in the
+    same scope has cosine similarity >= threshold with the new one.
+    Entries are evicted least-recently-used beyond max_entries and after ttl seconds,
+    and the whole cache is dropped whenever the index version changes.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                 ttl=ANSWER_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.index_version = None
+        self._entries = OrderedDict()  # id -> (scope, unit vector, value, created_at)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(vec):
+        vec = np.asarray(vec, dtype="float32").ravel()
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def _expire(self, now):
+        expired = [key for key, (_, _, _, created) in self._entries.items() if now - created > self.ttl]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, query_vec, scope=None):
+        """Return the cached value for the closest matching query, or None."""
+        q = self._normalize(query_vec)
+        with self._lock:
+            self._expire(time.monotonic())
+            candidates = [(key, vec) for key, (s, vec, _, _) in self._entries.items()
+                          if s == scope and vec.shape == q.shape]
+            if candidates:
+                sims = np.stack([vec for _, vec in candidates]) @ q
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    key = candidates[best][0]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][2]
+            self.misses += 1
+            return None
+
+    def store(self, query_vec, value, scope=None):
+        q = self._normalize(query_vec)
+        with self._lock:
+            self._entries[self._next_id] = (scope, q, value, time.monotonic())
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def set_index_version(self, version):
+        """Drop every cached answer if the loaded index is not the one they were computed on."""
+        if version != self.index_version:
+            self.invalidate()
+            self.index_version = version
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "index_version": self.index_version,
+        }
+
+
+def cache_scope(top_k, filters=None, asins=()):
+    """
+    Scope of a cached answer: answers are only reused between queries with the same top_k,
+    filters and named products (asins, e.g. MultimodalStore.named_asins), since questions
+    that differ only in an ASIN can have near-identical embeddings.
+    """
+    filters = filters or {}
+    return (top_k, tuple(sorted((field, json.dumps(value)) for field, value in filters.items())),
+            tuple(sorted(asins)))
+
+
+# Shared by every entry point in the process
+answer_cache = SemanticAnswerCache()
@@ -0,0 +1,247 @@
+# Batch question answering for offline / bulk workloads (e.g. the nightly ticket backfill):
+# a batch of queries is embedded together, searched with one index.search per modality,
+# captioned once and answered with one LLM call per distinct prompt, bounded in concurrency.
+
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+from src.embedding.image_embadding import embed_images
+from src.embedding.text_embedding import embed_texts
+from src.ingestion.caption_cache import caption_images
+from src.ingestion.load_json_and_chunk import iter_batches
+from src.rag_pipeline.reranker import RERANK_CANDIDATES, RERANK_ENABLED, rerank
+from src.rag_pipeline.retriever import load_faiss_index
+from src.utils.prompt_builder import build_prompt, context_metadata
+from src.utils.run_llm import LLM_MAX_CONCURRENCY, arun_llm
+
+BATCH_SIZE = int(os.getenv("BATCH_QUERY_SIZE", "2048"))  # records retrieved together
+BATCH_EMBED_SIZE = int(os.getenv("BATCH_EMBED_SIZE", "256"))  # queries per CLIP forward pass
+RERANK_WORKERS = 8  # concurrent rerank calls, so the rerank batcher can merge their pairs
+
+# Record keys (same as the API's QueryRequest) -> keyword index filter fields
+_FILTER_KEYS = {"asins": "asin", "category": "category", "source_file": "source_file"}
+
+
+def record_filters(record):
+    filters = {field: record[key] for key, field in _FILTER_KEYS.items() if record.get(key) is not None}
+    return filters or None
+
+
+def _validate(record):
+    """Why a record cannot be answered, or None. Image files are checked to be readable images."""
+    if not record.get("query") and not record.get("image_path"):
+        return "Provide a text query and/or an image."
+    if record.get("image_path"):
+        try:
+            with Image.open(record["image_path"]) as img:
+                img.verify()
+        except Exception as e:
+            return f"Unreadable image {record['image_path']}: {e}"
+    return None
+
+
+def _embed_unique(values, embed_fn):
+    """
+    {value: vector}, each distinct value embedded once, BATCH_EMBED_SIZE per forward pass.
+    When a batch fails its values are embedded one by one, and the ones that still fail are left out.
+    """
+    unique = list(dict.fromkeys(values))
+    vectors = {}
+    for start in range(0, len(unique), BATCH_EMBED_SIZE):
+        batch = unique[start:start + BATCH_EMBED_SIZE]
+        try:
+            vectors.update(zip(batch, embed_fn(batch, batch_size=BATCH_EMBED_SIZE, use_cache=False)))
+        except Exception:
+            for value in batch:
+                try:
+                    vectors[value] = embed_fn([value], batch_size=1, use_cache=False)[0]
+                except Exception as e:
+                    print(f"⚠️ Warning: could not embed {value!r} ({e})")
+    return vectors
+
+
+def retrieve_batch(vectorstore, records, k=4, use_reranker=RERANK_ENABLED):
+    """
+    Retrieve the context of every record ({"query", "image_path", "top_k", "asins", "category",
+    "source_file"}). Returns (docs per record, error per record); records that fail validation
+    or embedding (e.g. an unreadable image) get docs None and an error message.
+    Queries naming a catalog ASIN are answered from the keyword index without embedding. The
+    rest are embedded together (each distinct text / image once); unfiltered queries are
+    searched with one index.search per modality over the whole query matrix, filtered ones
+    one by one with their filters.
+    """
+    errors = [_validate(record) for record in records]
+    top_ks = [record.get("top_k") or k for record in records]
+    search_k = max(top_ks, default=k)
+    if use_reranker:
+        search_k = max(search_k, RERANK_CANDIDATES)
+    results = [None] * len(records)
+
+    pending = []
+    for i, record in enumerate(records):
+        if errors[i] is not None:
+            continue
+        query = record.get("query")
+        rows = []
+        if query:
+            rows = vectorstore.exact_matches(query, top_ks[i], vectorstore.filter_ids(record_filters(record)))
+        if rows:
+            results[i] = [vectorstore.docs[row] for row in rows]
+        else:
+            pending.append(i)
+
+    text_vecs = _embed_unique([records[i]["query"] for i in pending if records[i].get("query")], embed_texts)
+    image_vecs = _embed_unique([records[i]["image_path"] for i in pending if records[i].get("image_path")],
+                               embed_images)
+    failed = {i for i in pending
+              if (records[i].get("query") and records[i]["query"] not in text_vecs)
+              or (records[i].get("image_path") and records[i]["image_path"] not in image_vecs)}
+    for i in failed:
+        errors[i] = "Could not embed the query."
+    pending = [i for i in pending if i not in failed]
+
+    def vectors(i):
+        record = records[i]
+        return text_vecs.get(record.get("query")), image_vecs.get(record.get("image_path")), record.get("query")
+
+    hits = {}
+    unfiltered = [i for i in pending if not record_filters(records[i])]
+    if unfiltered:
+        text_list, image_list, query_list = zip(*(vectors(i) for i in unfiltered))
+        found = vectorstore.search_batch(list(text_list), list(image_list), k=search_k, query_texts=list(query_list),
+                                         with_scores=True)
+        hits.update(zip(unfiltered, found))
+    for i in pending:
+        if i not in hits:
+            text_vec, image_vec, query = vectors(i)
+            hits[i] = vectorstore.search(text_vec=text_vec, image_vec=image_vec, k=search_k, query_text=query,
+                                         filters=record_filters(records[i]), with_scores=True)
+
+    def finish(i):
+        query = records[i].get("query")
+        docs = [doc for doc, _ in hits[i]]
+        if use_reranker and query:
+            return rerank(query, docs, top_k=top_ks[i], scores=[score for _, score in hits[i]])
+        return docs[:top_ks[i]]
+
+    with ThreadPoolExecutor(max_workers=RERANK_WORKERS if use_reranker else 1) as pool:
+        for i, docs in zip(pending, pool.map(finish, pending)):
+            results[i] = docs
+    return results, errors
+
+
+def build_prompts(records, docs_lists):
+    """
+    Prompt per record (None where there are no docs). Every image the prompts need a caption
+    for (query images, context images without an ingestion-time caption) is captioned once,
+    in batches, through the caption cache before the prompts are built.
+    """
+    paths = [record["image_path"] for record, docs in zip(records, docs_lists)
+             if docs is not None and record.get("image_path")]
+    paths += [d.metadata["image_path"] for docs in docs_lists if docs for d in docs
+              if not d.metadata.get("image_caption") and d.metadata.get("image_path")
+              and Path(d.metadata["image_path"]).exists()]
+    unique = list(dict.fromkeys(paths))
+    if unique:
+        try:
+            caption_images(unique)
+        except Exception as e:  # build_prompt captions (and reports) the failing images one by one
+            print(f"⚠️ Warning: batch captioning failed ({e})")
+
+    return [build_prompt(record.get("query") or "", docs, query_image_path=record.get("image_path"))
+            if docs is not None else None
+            for record, docs in zip(records, docs_lists)]
+
+
+async def generate_answers(prompts, concurrency=LLM_MAX_CONCURRENCY):
+    """(answer, error) per prompt; each distinct prompt is sent to the LLM once, at most concurrency at a time."""
+    slots = asyncio.Semaphore(concurrency)
+
+    async def answer(prompt):
+        async with slots:
+            try:
+                return await arun_llm(prompt), None
+            except Exception as e:
+                return None, str(e)
+
+    unique = list(dict.fromkeys(p for p in prompts if p is not None))
+    answers = dict(zip(unique, await asyncio.gather(*(answer(p) for p in unique))))
+    return [answers.get(p, (None, None)) for p in prompts]
+
+
+async def answer_batch(vectorstore, records, k=4, generate=True, llm_concurrency=LLM_MAX_CONCURRENCY,
+                       run_blocking=asyncio.to_thread):
+    """
+    Answer a batch of query records. Returns one dict per record, in order:
+    {"id", "context", "answer"} or {"id", "error"}; generate=False stops after retrieval.
+    run_blocking(fn, *args) runs the CPU-bound stages (retrieval, captioning) off the event loop.
+    """
+    docs_lists, errors = await run_blocking(retrieve_batch, vectorstore, records, k)
+    answers = [(None, None)] * len(records)
+    if generate:
+        prompts = await run_blocking(build_prompts, records, docs_lists)
+        answers = await generate_answers(prompts, llm_concurrency)
+
+    results = []
+    for position, (record, docs, error, (answer, llm_error)) in enumerate(zip(records, docs_lists, errors, answers)):
+        result = {"id": record.get("id", position)}
+        if error is not None:
+            result["error"] = error
+        else:
+            result["context"] = context_metadata(docs)
+            if llm_error is not None:
+                result["error"] = llm_error
+            elif generate:
+                result["answer"] = answer
+        results.append(result)
+    return results
+
+
+def read_jsonl(path):
+    """Yield the records of a JSONL file; "id" defaults to the line number."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"❌ {path}:{line_no}: invalid JSON ({e})") from e
+            record.setdefault("id", line_no)
+            yield record
+
+
+async def answer_jsonl(input_path, output_path, index_path="Dataset/processed_data/faiss.index", k=4, generate=True,
+                       batch_size=BATCH_SIZE, llm_concurrency=LLM_MAX_CONCURRENCY):
+    """Answer every record of input_path, batch_size at a time, writing one JSON result per line to output_path."""
+    vectorstore = load_faiss_index(index_path)
+    done = 0
+    with open(output_path, "w", encoding="utf-8") as out:
+        for records in iter_batches(read_jsonl(input_path), batch_size):
+            for result in await answer_batch(vectorstore, records, k, generate, llm_concurrency):
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            done += len(records)
+            print(f"✅ {done} queries answered")
+    return done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of queries (one QueryRequest per line).")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--index", default="Dataset/processed_data/faiss.index")
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=LLM_MAX_CONCURRENCY, help="LLM calls in flight")
+    parser.add_argument("--retrieve-only", action="store_true", help="return the context without calling the LLM")
+    args = parser.parse_args()
+
+    asyncio.run(answer_jsonl(args.input, args.output, args.index, args.top_k, not args.retrieve_only,
+                             args.batch_size, args.concurrency))
@@ -1,54 +1,167 @@
-# # src/rag_pipeline/reranker.py
-# ## better for text to text re-ranking
+# src/rag_pipeline/reranker.py
+# Optional cross-encoder rerank stage for text queries: (query, chunk) pairs of concurrent
+# requests share batched forward passes, scores are cached, and the stage is skipped when the
+# retrieval scores are already decisive or its latency budget is spent.
 
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List
 
+import numpy as np
+import torch
+from langchain.docstore.document import Document
 
+from src.embedding.micro_batcher import MicroBatcher
+from src.embedding.model_registry import RERANKER_MODEL_NAME, RERANKER_QUANTIZE, get_reranker
 
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "0") == "1"
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))  # retrieved chunks passed to the cross-encoder
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "256"))  # tokens per (query, chunk) pair
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+RERANK_BATCH_WAIT_MS = float(os.getenv("RERANK_BATCH_WAIT_MS", "5"))
+# Skip the cross-encoder when the k-th retrieval score beats the (k+1)-th by this share of the top score
+RERANK_MARGIN = float(os.getenv("RERANK_MARGIN", "0.15"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "0"))  # cross-encoder time per query, 0 = unlimited
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "8192"))
 
+_MODEL_TAG = f"{RERANKER_MODEL_NAME}{'@int8' if RERANKER_QUANTIZE else ''}:{RERANK_MAX_LENGTH}"
 
+_cache = OrderedDict()  # pair key -> score, least recently used first
+_cache_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_counts = {"calls": 0, "early_exits": 0, "over_budget": 0, "pairs_scored": 0, "pairs_cached": 0}
+_stages = {}  # stage -> [count, total seconds]
+_ms_per_pair = None  # moving average of the model time per pair, for the latency budget
 
 
-# from typing import List
-# from transformers import AutoTokenizer, AutoModelForSequenceClassification
-# import torch
-# from langchain.docstore.document import Document
+def record_stage(stage, seconds):
+    with _stats_lock:
+        entry = _stages.setdefault(stage, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
 
-# # Load cross-encoder model once
-# _rerank_model_name = "BAAI/bge-reranker-large"
-# _tokenizer = AutoTokenizer.from_pretrained(_rerank_model_name)
-# _model = AutoModelForSequenceClassification.from_pretrained(_rerank_model_name)
 
-# def rerank(query: str, docs: List[Document], top_k: int = 4, debug: bool = True) -> List[Document]:
-#     """
-#     Re-rank retrieved docs using a cross-encoder reranker.
-#     Args:
-#         query: User query text
-#         docs: List of LangChain Documents retrieved from FAISS
-#         top_k: Return top_k docs after reranking
-#     """
-#     if not docs:
-#         return []
+@contextmanager
+def timed(stage):
+    """Add the wall time of the block to the stage's timing in rerank_stats()."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
 
-#     pairs = [(query, d.page_content) for d in docs]
-#     inputs = _tokenizer(
-#         pairs,
-#         padding=True,
-#         truncation=True,
-#         max_length=512,
-#         return_tensors="pt"
-#     )
 
-#     with torch.no_grad():
-#         scores = _model(**inputs).logits.squeeze(-1).cpu().numpy()
+def _count(name, n=1):
+    with _stats_lock:
+        _counts[name] += n
 
-#     # Attach scores to docs
-#     scored_docs = list(zip(docs, scores))
-#     scored_docs.sort(key=lambda x: x[1], reverse=True)
 
-#     if debug:
-#         print("\n📊 Re-ranking scores:")
-#         for i, (d, s) in enumerate(scored_docs, 1):
-#             print(f"{i}. {d.metadata.get('product_name','Unknown')} | Score: {s:.4f}")
+def _pair_key(query, text):
+    digest = hashlib.sha256(f"{query}\0{text}".encode("utf-8")).hexdigest()
+    return f"{_MODEL_TAG}:{digest}"
 
-#     reranked_docs = [d for d, _ in scored_docs[:top_k]]
-#     return reranked_docs
+
+def _score_pairs(pairs):
+    """Cross-encoder relevance logits for one batch of (query, chunk text) pairs."""
+    global _ms_per_pair
+    model, tokenizer = get_reranker()
+    with timed("tokenize"):
+        inputs = tokenizer([q for q, _ in pairs], [t for _, t in pairs], padding=True, truncation=True,
+                           max_length=RERANK_MAX_LENGTH, return_tensors="pt")
+    start = time.perf_counter()
+    with torch.no_grad():
+        logits = model(**inputs).logits
+    elapsed = time.perf_counter() - start
+    record_stage("model", elapsed)
+
+    per_pair = elapsed * 1000 / len(pairs)
+    _ms_per_pair = per_pair if _ms_per_pair is None else 0.8 * _ms_per_pair + 0.2 * per_pair
+    _count("pairs_scored", len(pairs))
+    return logits[:, -1].float().cpu().numpy().tolist()
+
+
+_pair_batcher = MicroBatcher(_score_pairs, max_batch_size=RERANK_BATCH_SIZE, max_wait_ms=RERANK_BATCH_WAIT_MS,
+                             name="rerank-batcher")
+
+
+def is_decisive(scores, top_k, margin=RERANK_MARGIN):
+    """True when the retrieval scores (best-first) separate the top_k from the rest by margin * top score."""
+    if scores is None or len(scores) <= top_k:
+        return False
+    scores = np.asarray(scores, dtype="float64")
+    return (scores[top_k - 1] - scores[top_k]) >= margin * max(abs(scores[0]), 1e-9)
+
+
+def rerank(query: str, docs: List[Document], top_k: int = 4, scores=None, budget_ms: float = RERANK_BUDGET_MS,
+           debug: bool = False) -> List[Document]:
+    """
+    Re-rank retrieved docs (best-first) with the cross-encoder and return the top_k.
+    Args:
+        query: User query text
+        docs: Candidates from the vector store, at most RERANK_CANDIDATES are scored
+        top_k: Return top_k docs after reranking
+        scores: Retrieval scores of docs; when decisive (see is_decisive) the docs are returned as they are
+        budget_ms: Cross-encoder time allowed for this query (estimated from recent batches);
+                   candidates that do not fit keep their retrieval order behind the reranked ones
+    """
+    start = time.perf_counter()
+    _count("calls")
+    if len(docs) <= top_k or is_decisive(scores, top_k):
+        _count("early_exits")
+        record_stage("rerank", time.perf_counter() - start)
+        return docs[:top_k]
+
+    docs = docs[:RERANK_CANDIDATES]
+    keys = [_pair_key(query, d.page_content) for d in docs]
+    with _cache_lock:
+        known = {}
+        for key in keys:
+            if key in _cache:
+                _cache.move_to_end(key)
+                known[key] = _cache[key]
+    _count("pairs_cached", len(known))
+
+    affordable = int(budget_ms / _ms_per_pair) if budget_ms and _ms_per_pair else len(docs)
+    selected, futures = [], {}
+    for i, (doc, key) in enumerate(zip(docs, keys)):
+        if key not in known and key not in futures:
+            if len(futures) >= affordable:
+                _count("over_budget")
+                break
+            futures[key] = _pair_batcher.submit((query, doc.page_content))
+        selected.append(i)
+
+    new = {key: fut.result() for key, fut in futures.items()}
+    with _cache_lock:
+        _cache.update(new)
+        while len(_cache) > RERANK_CACHE_SIZE:
+            _cache.popitem(last=False)
+    known.update(new)
+
+    order = sorted(selected, key=lambda i: known[keys[i]], reverse=True)
+    reranked = [docs[i] for i in order] + docs[len(selected):]
+    record_stage("rerank", time.perf_counter() - start)
+
+    if debug:
+        print("\n📊 Re-ranking scores:")
+        for rank, i in enumerate(order, 1):
+            print(f"{rank}. {docs[i].metadata.get('product_name', 'Unknown')} | Score: {known[keys[i]]:.4f}")
+
+    return reranked[:top_k]
+
+
+def rerank_stats():
+    with _stats_lock:
+        stats = dict(_counts)
+        stats["stages_ms"] = {
+            stage: {"count": count, "avg": total * 1000 / count, "total": total * 1000}
+            for stage, (count, total) in _stages.items()
+        }
+    stats["model"] = _MODEL_TAG
+    stats["ms_per_pair"] = _ms_per_pair
+    stats["batching"] = _pair_batcher.stats()
+    return stats
@@ -2,24 +2,122 @@
 # ==============================
 # Load FAISS index
 # ==============================
-from langchain_community.vectorstores import FAISS
-import pickle
-
-def load_faiss_index(index_path):
+import asyncio
+import os
+import faiss
+from src.vector_space.vectordb import (
+    chunk_store_path, docstore_path, image_index_path, keyword_index_path, load_docstore, load_manifest,
+    drop_legacy_docstore, write_keyword_index,
+)
+from src.vector_space.bm25_index import BM25Index
+from src.vector_space.chunk_store import ChunkStore, SCHEMA_FILE, migrate_docs
+from src.vector_space.index_factory import needs_rescoring, set_search_params
+from src.vector_space.multimodal_store import MultimodalStore
+from src.rag_pipeline.answer_cache import answer_cache
+
+def _read_index(index_path):
+    """Read a FAISS index, memory-mapping it when the index type allows."""
+    try:
+        return faiss.read_index(index_path, faiss.IO_FLAG_MMAP)
+    except RuntimeError:
+        return faiss.read_index(index_path)
+
+
+def _split_legacy_index(index_path):
+    """Split an old concatenated [text, image] flat index into (text, image) flat indexes, in memory."""
+    index = faiss.read_index(index_path)
+    if not isinstance(faiss.downcast_index(index), faiss.IndexFlat) or index.d % 2:
+        raise ValueError(f"❌ {image_index_path(index_path)} is missing — rebuild the index.")
+
+    vectors = index.reconstruct_n(0, index.ntotal)
+    half = index.d // 2
+    parts = []
+    for part in (vectors[:, :half], vectors[:, half:]):
+        split = faiss.IndexFlatL2(half)
+        split.add(np.ascontiguousarray(part))
+        parts.append(split)
+    return parts
+
+
+def _migrate_legacy_build(index_path):
     """
-    Load a multimodal FAISS index using precomputed embeddings.
+    Migrate an older build (concatenated 1024-dim index, JSONL docstore) once, on first load.
+    Everything is checked and produced before the old files are replaced, so a build that
+    cannot be migrated is left as it was.
     """
-    with open(index_path.replace(".index", "_store.pkl"), "rb") as f:
-        docs, embeddings, metadata_list = pickle.load(f)
-
-    if not docs or not embeddings.any():
+    split = not os.path.exists(image_index_path(index_path))
+    migrate = not os.path.isdir(chunk_store_path(index_path))
+    store_path = docstore_path(index_path)
+    if migrate and not os.path.exists(store_path):
+        raise ValueError(f"❌ {chunk_store_path(index_path)} is missing — rebuild the index "
+                         "(pickle stores are no longer loaded).")
+
+    if split:
+        text_index, image_index = _split_legacy_index(index_path)
+    else:
+        text_index, image_index = faiss.read_index(index_path), faiss.read_index(image_index_path(index_path))
+    if migrate:
+        n = migrate_docs(load_docstore(store_path), chunk_store_path(index_path), text_index, image_index)
+        print(f"ℹ️ Migrated {n} chunks from {store_path} to {chunk_store_path(index_path)}")
+    if split:
+        # The image index goes in first: its absence is what marks the text index as unsplit
+        for index, path in ((image_index, image_index_path(index_path)), (text_index, index_path)):
+            faiss.write_index(index, f"{path}.tmp")
+        os.replace(f"{image_index_path(index_path)}.tmp", image_index_path(index_path))
+        os.replace(f"{index_path}.tmp", index_path)
+        print(f"ℹ️ Split legacy {2 * text_index.d}-dim index into text and image indexes")
+    if migrate:
+        drop_legacy_docstore(index_path)
+
+
+def index_version(index_path):
+    """Identifies one build of the index on disk (changes whenever it is rebuilt)."""
+    paths = (index_path, image_index_path(index_path), os.path.join(chunk_store_path(index_path), SCHEMA_FILE))
+    return ":".join(f"{st.st_mtime_ns}-{st.st_size}" for st in map(os.stat, paths))
+
+
+# Query-time ANN tuning (ignored for the flat index)
+INDEX_NPROBE = int(os.getenv("INDEX_NPROBE", "16"))
+INDEX_EF_SEARCH = int(os.getenv("INDEX_EF_SEARCH", "64"))
+# Quantized indexes (ivf_pq, sq_fp16, sq_int8, binary): shortlist size = k * RESCORE_FACTOR
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", "4"))
+# Share of the BM25 ranking in hybrid text retrieval (0 = CLIP only)
+KEYWORD_WEIGHT = float(os.getenv("KEYWORD_WEIGHT", "0.3"))
+
+
+def load_faiss_index(index_path, nprobe=INDEX_NPROBE, ef_search=INDEX_EF_SEARCH, rescore_factor=RESCORE_FACTOR,
+                     keyword_weight=KEYWORD_WEIGHT):
+    """
+    Load the persisted text/image FAISS indexes and the chunk store into a MultimodalStore.
+    Indexes and chunk store are memory-mapped: nothing is copied or unpickled up front and
+    chunk texts/metadata are decoded only for the retrieved rows.
+    nprobe (IVF) and ef_search (HNSW) set the recall/latency trade-off of ANN indexes;
+    quantized index types are searched for k * rescore_factor candidates that are then
+    rescored exactly on the float32 vectors of the chunk store.
+    The BM25 keyword index (exact ASIN lookups, hybrid text ranking) is loaded alongside.
+    Older builds (concatenated 1024-dim index, JSONL docstore, no BM25 index) are migrated
+    once on first load.
+    """
+    if not os.path.exists(image_index_path(index_path)) or not os.path.isdir(chunk_store_path(index_path)):
+        _migrate_legacy_build(index_path)
+
+    text_index = _read_index(index_path)
+    image_index = _read_index(image_index_path(index_path))
+    for index in (text_index, image_index):
+        set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+    docs = ChunkStore(chunk_store_path(index_path))
+    if not os.path.isdir(keyword_index_path(index_path)):
+        print(f"ℹ️ Built BM25 index for {write_keyword_index(index_path)} chunks")
+
+    if not docs or text_index.ntotal == 0:
         raise ValueError("❌ FAISS store is empty — check build_faiss_index output.")
 
-    vectorstore = FAISS.from_embeddings(
-        text_embeddings=[(doc.page_content, emb) for doc, emb in zip(docs, embeddings)],
-        embedding=None,  # Already have embeddings
-        metadatas=metadata_list
-    )
+    if not needs_rescoring(load_manifest(index_path).get("index_type", "flat")):
+        rescore_factor = 0
+    vectorstore = MultimodalStore(text_index, image_index, docs, rescore_factor=rescore_factor,
+                                  keyword_index=BM25Index(keyword_index_path(index_path)),
+                                  keyword_weight=keyword_weight)
+    answer_cache.set_index_version(index_version(index_path))
     return vectorstore
 
 
@@ -38,40 +136,113 @@ def load_faiss_index(index_path):
 
 import numpy as np
 from pathlib import Path
-from langchain_community.vectorstores import FAISS
-from src.embedding.text_embedding import embed_text
-from src.embedding.image_embadding import embed_image
+from src.embedding.text_embedding import embed_texts
+from src.embedding.image_embadding import embed_images
+from src.embedding.micro_batcher import MicroBatcher
+from src.rag_pipeline.reranker import RERANK_CANDIDATES, RERANK_ENABLED, rerank, timed
 
 # --------------------------
-# Helper: concat embedding spaces
+# Query micro-batching: concurrent requests share one CLIP forward pass
 # --------------------------
-def embed_query_for_concat_space(query_text: str) -> np.ndarray:
-    q_text = embed_text(query_text, debug=False)
-    q_img_pad = np.zeros_like(q_text)
-    return np.concatenate([q_text, q_img_pad]).astype("float32")
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+QUERY_BATCH_WAIT_MS = float(os.getenv("QUERY_BATCH_WAIT_MS", "5"))
+
+_text_batcher = MicroBatcher(
+    lambda texts: embed_texts(texts, batch_size=QUERY_BATCH_MAX_SIZE, use_cache=False),
+    max_batch_size=QUERY_BATCH_MAX_SIZE, max_wait_ms=QUERY_BATCH_WAIT_MS, name="text-query-batcher",
+)
+_image_batcher = MicroBatcher(
+    lambda images: embed_images(images, batch_size=QUERY_BATCH_MAX_SIZE, use_cache=False),
+    max_batch_size=QUERY_BATCH_MAX_SIZE, max_wait_ms=QUERY_BATCH_WAIT_MS, name="image-query-batcher",
+)
 
 
-def embed_image_for_concat_space(image_path: str) -> np.ndarray:
-    img_emb = embed_image(image_path, debug=False)
-    img_text_pad = np.zeros_like(img_emb)
-    return np.concatenate([img_text_pad, img_emb]).astype("float32")
+def query_batching_stats():
+    return {"text": _text_batcher.stats(), "image": _image_batcher.stats()}
+
+
+# --------------------------
+# Helper: query embeddings (512-dim, one per modality)
+# --------------------------
+def embed_query_text(query_text: str) -> np.ndarray:
+    return np.asarray(_text_batcher(query_text), dtype="float32")
+
+
+def embed_query_image(image) -> np.ndarray:
+    """image: a path or an already decoded PIL image (e.g. an upload, see src.utils.uploads)."""
+    return np.asarray(_image_batcher(image), dtype="float32")
+
+
+# Async versions for the API: the event loop awaits the batcher directly, so waiting requests do not
+# hold inference-pool threads and a batch can grow to QUERY_BATCH_MAX_SIZE
+async def aembed_query_text(query_text: str) -> np.ndarray:
+    return np.asarray(await asyncio.wrap_future(_text_batcher.submit(query_text)), dtype="float32")
+
+
+async def aembed_query_image(image) -> np.ndarray:
+    return np.asarray(await asyncio.wrap_future(_image_batcher.submit(image)), dtype="float32")
 
 
 # --------------------------
 # Retrieval functions
 # --------------------------
-def retrieve_by_text(vectorstore, query_text: str, k: int = 4):
-    q_vec = embed_query_for_concat_space(query_text)
-    return vectorstore.similarity_search_by_vector(embedding=q_vec, k=k)
+def _search(vectorstore, k, query_text=None, use_reranker=RERANK_ENABLED, **search_kwargs):
+    """
+    vectorstore.search for the top k, or, with the reranker on and a text query, for
+    RERANK_CANDIDATES candidates that the cross-encoder narrows down to k.
+    """
+    if not (use_reranker and query_text):
+        return vectorstore.search(k=k, query_text=query_text, **search_kwargs)
+    with timed("retrieve"):
+        hits = vectorstore.search(k=max(k, RERANK_CANDIDATES), query_text=query_text, with_scores=True,
+                                  **search_kwargs)
+    return rerank(query_text, [doc for doc, _ in hits], top_k=k, scores=[score for _, score in hits])
 
 
-def retrieve_by_image(vectorstore, image_path: str, k: int = 4):
-    q_vec = embed_image_for_concat_space(image_path)
-    return vectorstore.similarity_search_by_vector(embedding=q_vec, k=k)
+def search_by_vector(vectorstore, text_vec: np.ndarray = None, k: int = 4, image_vec: np.ndarray = None,
+                     fusion: str = "weighted", text_weight: float = 0.5, query_text: str = None,
+                     filters: dict = None, use_reranker: bool = RERANK_ENABLED):
+    """
+    Retrieve with already embedded queries (e.g. a text vector also used as the answer cache key).
+    Pass the raw query_text as well for the exact-ASIN fast path, hybrid BM25 ranking and reranking.
+    filters ({"asin": [...], "category": ..., "source_file": ...}) scopes the search to the
+    matching chunks before the index is scanned.
+    """
+    return _search(vectorstore, k, query_text, use_reranker, text_vec=text_vec, image_vec=image_vec, fusion=fusion,
+                   text_weight=text_weight, filters=filters)
+
 
+def retrieve_by_text(vectorstore, query_text: str, k: int = 4, filters: dict = None,
+                     use_reranker: bool = RERANK_ENABLED):
+    """Exact-ASIN lookup if the query names a product, else hybrid BM25 + CLIP text retrieval."""
+    rows = vectorstore.exact_matches(query_text, k, vectorstore.filter_ids(filters))
+    if rows:  # no CLIP forward pass or vector scan needed
+        return [vectorstore.docs[row] for row in rows]
+    return _search(vectorstore, k, query_text, use_reranker, text_vec=embed_query_text(query_text), filters=filters)
 
-def retrieve_by_text_and_image(vectorstore, query_text: str, image_path: str, k: int = 4):
-    text_emb = embed_query_for_concat_space(query_text)
-    image_emb = embed_image_for_concat_space(image_path)
-    combined_emb = (text_emb + image_emb) / 2.0
-    return vectorstore.similarity_search_by_vector(embedding=combined_emb, k=k)
+
+def retrieve_by_image(vectorstore, image_path, k: int = 4, filters: dict = None):
+    """image_path: a path or a decoded PIL image."""
+    return vectorstore.search(image_vec=embed_query_image(image_path), k=k, filters=filters)
+
+
+def retrieve_by_text_and_image(vectorstore, query_text: str, image_path, k: int = 4,
+                               text_weight: float = 0.5, fusion: str = "weighted", filters: dict = None,
+                               use_reranker: bool = RERANK_ENABLED):
+    """
+    Search the text and image indexes separately and fuse the rankings.
+    text_weight in [0, 1] sets how much the text query counts against the image;
+    fusion is "weighted" (score sum) or "rrf" (reciprocal-rank fusion).
+    image_path may also be a decoded PIL image.
+    """
+    return _search(
+        vectorstore,
+        k,
+        query_text,
+        use_reranker,
+        text_vec=embed_query_text(query_text),
+        image_vec=embed_query_image(image_path),
+        fusion=fusion,
+        text_weight=text_weight,
+        filters=filters,
+    )
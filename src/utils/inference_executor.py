@@ -0,0 +1,51 @@
+# Bounded thread pool for blocking model inference (CLIP, BLIP, FAISS) called from async endpoints
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "4"))
+INFERENCE_MAX_PENDING = int(os.getenv("INFERENCE_MAX_PENDING", "32"))
+
+_executor = None
+_pending = 0
+
+
+class InferenceBusyError(RuntimeError):
+    """Raised when more than INFERENCE_MAX_PENDING inference calls are already queued or running."""
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+    return _executor
+
+
+async def run_inference(fn, *args, **kwargs):
+    """
+    Run a blocking fn(*args, **kwargs) on the inference pool without blocking the event loop.
+    Rejects the call with InferenceBusyError instead of queueing unboundedly.
+    """
+    global _pending
+    if _pending >= INFERENCE_MAX_PENDING:
+        raise InferenceBusyError(f"Inference queue full ({_pending} pending)")
+
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), functools.partial(fn, *args, **kwargs))
+    finally:
+        _pending -= 1
+
+
+def pending_count():
+    return _pending
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
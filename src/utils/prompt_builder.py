@@ -7,7 +7,7 @@ from textwrap import shorten
 
 
 
-from src.ingestion.process_image import preprocess_image  # Returns caption
+from src.ingestion.caption_cache import caption_image, caption_image_data  # Returns caption, cached by image hash
 
 
 
@@ -15,14 +15,31 @@ from src.ingestion.process_image import preprocess_image  # Returns caption
 
 
 # -------------------------- Prompt Builder --------------------------
-def build_prompt(query: str, docs, query_image_path: str = None):
+def context_metadata(docs):
+    """Metadata of the retrieved docs returned to API clients next to the answer."""
+    return [
+        {
+            "product_name": d.metadata.get("product_name", "Unknown"),
+            "asin": d.metadata.get("asin", "?"),
+            "image_path": d.metadata.get("image_path"),
+            "source_file": d.metadata.get("source_file"),
+        }
+        for d in docs
+    ]
+
+
+def build_prompt(query: str, docs, query_image_path: str = None, query_image=None):
+    """query_image: an uploaded QueryImage (src.utils.uploads), captioned without touching the disk."""
     contexts = []
 
     # Caption query image if provided
     query_img_desc = ""
-    if query_image_path and Path(query_image_path).exists():
+    if query_image is not None or (query_image_path and Path(query_image_path).exists()):
         try:
-            q_caption = preprocess_image(query_image_path)
+            if query_image is not None:
+                q_caption = caption_image_data(query_image.data, query_image.image)
+            else:
+                q_caption = caption_image(query_image_path)
             query_img_desc = f"\n\nQuestion Image: {q_caption}"
         except Exception as e:
             query_img_desc = f"\n\n[Query image processing failed: {e}]"
@@ -35,9 +52,12 @@ def build_prompt(query: str, docs, query_image_path: str = None):
 
         image_desc = ""
         image_path = meta.get("image_path")
-        if image_path and Path(image_path).exists():
+        if meta.get("image_caption"):
+            # Captioned at ingestion time
+            image_desc = f"\n  Image Description: {meta['image_caption']}"
+        elif image_path and Path(image_path).exists():
             try:
-                caption = preprocess_image(image_path)
+                caption = caption_image(image_path)
                 image_desc = f"\n  Image Description: {caption}"
             except Exception as e:
                 image_desc = f"\n  [Image processing failed: {e}]"
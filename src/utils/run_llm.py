@@ -3,6 +3,10 @@
 
 # main.py
 import os
+import time
+import random
+import asyncio
+import threading
 
 from dotenv import load_dotenv
 
@@ -12,18 +16,134 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 # Load .env
 load_dotenv()
 
-def run_llm(prompt: str):
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise ValueError("❌ GEMINI_API_KEY not set in .env")
-
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-1.5-flash",
-        temperature=0.2,
-        google_api_key=api_key
-    )
-    resp = llm.invoke(prompt)
-    print("\n🟩 Answer:\n")
-    print(resp.content)
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-1.5-flash")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))              # seconds per request
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))  # seconds, doubled per attempt
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+# One client per process, reused across calls so its HTTP/gRPC channel stays open
+_llm = None
+_llm_lock = threading.Lock()
+_sync_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+_async_slots = None
+
+
+def get_llm():
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                api_key = os.getenv("GEMINI_API_KEY")
+                if not api_key:
+                    raise ValueError("❌ GEMINI_API_KEY not set in .env")
+
+                _llm = ChatGoogleGenerativeAI(
+                    model=LLM_MODEL,
+                    temperature=0.2,
+                    google_api_key=api_key,
+                    timeout=LLM_TIMEOUT,
+                    max_retries=0,  # retried below with jittered backoff
+                )
+    return _llm
+
+
+def _backoff(attempt):
+    """Full-jitter exponential backoff delay for the given retry attempt."""
+    return random.uniform(0, LLM_BACKOFF_BASE * (2 ** attempt))
+
+
+def _get_async_slots():
+    global _async_slots
+    if _async_slots is None:
+        _async_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _async_slots
+
+
+def run_llm(prompt: str, debug: bool = False):
+    llm = get_llm()
+    with _sync_slots:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            try:
+                resp = llm.invoke(prompt)
+                break
+            except Exception as e:
+                if attempt == LLM_MAX_RETRIES:
+                    raise
+                delay = _backoff(attempt)
+                print(f"⚠️ LLM call failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    if debug:
+        print("\n🟩 Answer:\n")
+        print(resp.content)
     return resp.content
 
+
+async def arun_llm(prompt: str):
+    """Async variant of run_llm for the FastAPI endpoints (does not block the event loop)."""
+    llm = get_llm()
+    async with _get_async_slots():
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            try:
+                resp = await llm.ainvoke(prompt)
+                break
+            except Exception as e:
+                if attempt == LLM_MAX_RETRIES:
+                    raise
+                delay = _backoff(attempt)
+                print(f"⚠️ LLM call failed ({e}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+    return resp.content
+
+
+def _chunk_text(chunk):
+    content = chunk.content
+    if isinstance(content, list):  # some providers return content parts
+        return "".join(p.get("text", "") if isinstance(p, dict) else str(p) for p in content)
+    return content or ""
+
+
+def stream_llm(prompt: str):
+    """
+    Yield the answer text incrementally as Gemini produces it.
+    Failures are retried only until the first token has been yielded.
+    """
+    llm = get_llm()
+    with _sync_slots:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            started = False
+            try:
+                for chunk in llm.stream(prompt):
+                    text = _chunk_text(chunk)
+                    if text:
+                        started = True
+                        yield text
+                return
+            except Exception as e:
+                if started or attempt == LLM_MAX_RETRIES:
+                    raise
+                delay = _backoff(attempt)
+                print(f"⚠️ LLM stream failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+
+async def astream_llm(prompt: str):
+    """Async variant of stream_llm for the FastAPI SSE endpoint."""
+    llm = get_llm()
+    async with _get_async_slots():
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            started = False
+            try:
+                async for chunk in llm.astream(prompt):
+                    text = _chunk_text(chunk)
+                    if text:
+                        started = True
+                        yield text
+                return
+            except Exception as e:
+                if started or attempt == LLM_MAX_RETRIES:
+                    raise
+                delay = _backoff(attempt)
+                print(f"⚠️ LLM stream failed ({e}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
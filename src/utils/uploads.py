@@ -0,0 +1,100 @@
+# Uploaded query images: decoded once in memory (with size limits) and handed to CLIP and
+# BLIP as PIL images; persisted only on request, under their content hash.
+
+import hashlib
+import io
+import os
+import tempfile
+
+from PIL import Image
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_MAX_PIXELS = int(os.getenv("UPLOAD_MAX_PIXELS", "40000000"))  # rejects decompression bombs
+UPLOAD_PERSIST = os.getenv("UPLOAD_PERSIST", "0") == "1"  # keep a copy of every upload in UPLOAD_DIR
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+UPLOAD_DIR_MAX_BYTES = int(os.getenv("UPLOAD_DIR_MAX_BYTES", str(1024 ** 3)))  # oldest files evicted beyond this
+
+
+class UploadError(ValueError):
+    """An upload that was rejected; status is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class QueryImage:
+    """An uploaded image decoded once: its bytes, their sha256 and the RGB PIL image."""
+
+    def __init__(self, data, image, image_format):
+        self.data = data
+        self.image = image
+        self.format = (image_format or "bin").lower()
+        self.digest = hashlib.sha256(data).hexdigest()
+
+
+def to_rgb(image):
+    """RGB PIL image from a PIL image (used as is) or anything PIL can open (path, file object)."""
+    if isinstance(image, Image.Image):
+        return image if image.mode == "RGB" else image.convert("RGB")
+    return Image.open(image).convert("RGB")
+
+
+def decode_upload(data: bytes, max_bytes=UPLOAD_MAX_BYTES, max_pixels=UPLOAD_MAX_PIXELS) -> QueryImage:
+    """Decode uploaded bytes into a QueryImage, rejecting oversized or unreadable images with UploadError."""
+    if len(data) > max_bytes:
+        raise UploadError(f"Image is larger than {max_bytes} bytes.", status=413)
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            if img.width * img.height > max_pixels:
+                raise UploadError(f"Image has more than {max_pixels} pixels.", status=413)
+            return QueryImage(data, img.convert("RGB"), img.format)
+    except UploadError:
+        raise
+    except Exception as e:
+        raise UploadError(f"Not a readable image ({e}).")
+
+
+def store_upload(query_image: QueryImage, upload_dir=UPLOAD_DIR, max_dir_bytes=UPLOAD_DIR_MAX_BYTES):
+    """
+    Persist an upload as <upload_dir>/<sha256>.<format> and return the path. The same content
+    always maps to the same file, so concurrent uploads never overwrite each other; the oldest
+    files are evicted once the directory holds more than max_dir_bytes.
+    """
+    os.makedirs(upload_dir, exist_ok=True)
+    path = os.path.join(upload_dir, f"{query_image.digest}.{query_image.format}")
+    try:
+        os.utime(path)  # already stored: recently used, evicted last
+        return path
+    except FileNotFoundError:
+        pass
+
+    fd, tmp_path = tempfile.mkstemp(dir=upload_dir, suffix=".tmp")  # unique per call, even for the same content
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(query_image.data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    files = []
+    for entry in os.scandir(upload_dir):
+        if entry.name.endswith(".tmp"):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:  # evicted by a concurrent call
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, file_path in sorted(files):
+        if total <= max_dir_bytes or file_path == path:
+            break
+        total -= size
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+    return path
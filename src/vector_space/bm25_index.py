@@ -0,0 +1,281 @@
+# Local BM25 inverted index over the chunk texts, plus exact metadata -> chunk ids tables
+# (ASIN, category, source file) for the ASIN fast path and filtered search.
+# Catches exact tokens (ASINs, model numbers, error codes) that CLIP's 77-token text tower misses.
+
+import os
+import re
+import json
+import shutil
+from collections import Counter
+from itertools import islice
+
+import numpy as np
+
+from src.vector_space.chunk_store import replace_directory
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+FILTER_FIELDS = ("asin", "category", "source_file")
+BM25_BATCH_SIZE = 50_000  # chunks tokenized per spilled postings run
+POSTINGS_SLICE = 1 << 22  # postings copied per step when updating
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_WORD_RE = re.compile(r"[A-Za-z0-9]+")
+
+
+def tokenize(text):
+    """
+    Lowercase alphanumeric tokens. Compound codes ("cz-smart", "e-04", "usb3.0") are kept
+    whole and also split into their parts, so both spellings match.
+    """
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        parts = re.split(r"[-_./]", token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def _field_value(field, value):
+    """Table key of a metadata value; ASINs are matched case-insensitively."""
+    return str(value).upper() if field == "asin" else str(value)
+
+
+class _PostingsWriter:
+    """
+    Collects (term, row, tf) postings in runs spilled to disk, then writes them term-major
+    (rows.npy / tfs.npy sliced by offsets.npy) with one counting-sort pass over the runs,
+    so memory is bounded by the largest run. For each term, runs must be added in
+    increasing row order.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.runs = []
+        self.counts = np.zeros(0, dtype=np.int64)  # postings per term id
+
+    def add(self, terms, rows, tfs):
+        if not len(terms):
+            return
+        run_path = os.path.join(self.directory, f"run_{len(self.runs)}.npz")
+        np.savez(run_path, terms=terms, rows=rows, tfs=tfs)
+        self.runs.append(run_path)
+        counts = np.bincount(terms)
+        if len(counts) > len(self.counts):
+            self.counts = np.concatenate([self.counts, np.zeros(len(counts) - len(self.counts), dtype=np.int64)])
+        self.counts[:len(counts)] += counts
+
+    def close(self, n_terms):
+        counts = np.zeros(n_terms, dtype=np.int64)
+        counts[:len(self.counts)] = self.counts
+        offsets = np.zeros(n_terms + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        np.save(os.path.join(self.directory, "offsets.npy"), offsets)
+
+        total = int(offsets[-1])
+        rows_out = np.lib.format.open_memmap(os.path.join(self.directory, "rows.npy"), mode="w+",
+                                             dtype=np.int64, shape=(total,))
+        tfs_out = np.lib.format.open_memmap(os.path.join(self.directory, "tfs.npy"), mode="w+",
+                                            dtype=np.float32, shape=(total,))
+        cursor = offsets[:-1].copy()  # next free slot of each term
+        for run_path in self.runs:
+            with np.load(run_path) as run:
+                order = np.argsort(run["terms"], kind="stable")  # stable: rows stay increasing within a term
+                terms, rows, tfs = run["terms"][order], run["rows"][order], run["tfs"][order]
+            unique, first, counts = np.unique(terms, return_index=True, return_counts=True)
+            slots = cursor[terms] + np.arange(len(terms)) - np.repeat(first, counts)
+            rows_out[slots] = rows
+            tfs_out[slots] = tfs
+            cursor[unique] += counts
+            os.remove(run_path)
+        rows_out.flush()
+        tfs_out.flush()
+        del rows_out, tfs_out
+
+
+def _add_docs(items, first_row, vocab, writer, fields):
+    """
+    Tokenize one batch of (doc_id, Document) as rows first_row.. and add its postings as one
+    run; new terms get the next ids of vocab. Returns (row ids, lengths) of the batch.
+    """
+    terms, rows, tfs, row_ids, lengths = [], [], [], [], []
+    for row, (doc_id, doc) in enumerate(items, first_row):
+        counts = Counter(tokenize(doc.page_content))
+        for term, tf in counts.items():
+            terms.append(vocab.setdefault(term, len(vocab)))
+            rows.append(row)
+            tfs.append(tf)
+        row_ids.append(doc_id)
+        lengths.append(sum(counts.values()))
+        for field, table in fields.items():
+            value = doc.metadata.get(field)
+            if value:
+                table.setdefault(_field_value(field, value), []).append(int(doc_id))
+    writer.add(np.asarray(terms, dtype=np.int64), np.asarray(rows, dtype=np.int64),
+               np.asarray(tfs, dtype=np.float32))
+    return np.asarray(row_ids, dtype=np.int64), np.asarray(lengths, dtype=np.float32)
+
+
+def _add_doc_batches(docs, doc_ids, first_row, vocab, writer, fields, batch_size):
+    row_ids, lengths = [], []
+    doc_ids = iter(doc_ids)
+    while True:
+        batch = list(islice(doc_ids, batch_size))
+        if not batch:
+            return row_ids, lengths
+        ids, lens = _add_docs(((doc_id, docs[doc_id]) for doc_id in batch), first_row, vocab, writer, fields)
+        row_ids.append(ids)
+        lengths.append(lens)
+        first_row += len(batch)
+
+
+def _new_directory(path):
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    return tmp_path
+
+
+def _finish(tmp_path, path, writer, vocab, row_ids, lengths, fields):
+    writer.close(len(vocab))
+    row_ids = np.concatenate(row_ids) if row_ids else np.zeros(0, dtype=np.int64)
+    np.save(os.path.join(tmp_path, "row_ids.npy"), row_ids)
+    np.save(os.path.join(tmp_path, "lengths.npy"),
+            np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.float32))
+    with open(os.path.join(tmp_path, "terms.json"), "w", encoding="utf-8") as f:
+        json.dump(vocab, f, ensure_ascii=False)
+    with open(os.path.join(tmp_path, "fields.json"), "w", encoding="utf-8") as f:
+        json.dump(fields, f, ensure_ascii=False)
+    replace_directory(tmp_path, path)
+    return len(row_ids)
+
+
+def build_bm25_index(docs, path, batch_size=BM25_BATCH_SIZE):
+    """
+    Build the index for an {id: Document} mapping (e.g. a ChunkStore) into directory path:
+    postings as flat numpy arrays (row, term frequency) sliced by per-term offsets, the
+    vocabulary and the {field: {value: ids}} tables of FILTER_FIELDS as JSON.
+    Chunks are tokenized batch_size at a time into spilled runs that are merged at the end.
+    Written to path.tmp and swapped in. Returns the chunk count.
+    """
+    tmp_path = _new_directory(path)
+    vocab, fields = {}, {field: {} for field in FILTER_FIELDS}
+    writer = _PostingsWriter(tmp_path)
+    row_ids, lengths = _add_doc_batches(docs, iter(docs), 0, vocab, writer, fields, batch_size)
+    return _finish(tmp_path, path, writer, vocab, row_ids, lengths, fields)
+
+
+def update_bm25_index(path, docs, removed_ids, new_ids, batch_size=BM25_BATCH_SIZE):
+    """
+    Apply a catalog delta to the index at path: drop the chunks removed_ids and add new_ids
+    (looked up in docs; fresh ids, above every indexed one). Only the new chunks are
+    tokenized; surviving postings are copied over slice by slice with their rows renumbered.
+    Builds from scratch when there is no index at path. Returns the chunk count.
+    """
+    if not os.path.isdir(path):
+        return build_bm25_index(docs, path, batch_size)
+
+    old = BM25Index(path)
+    removed = set(int(i) for i in removed_ids)
+    keep = ~np.isin(old.row_ids, np.asarray(sorted(removed), dtype=np.int64))
+    new_rows = np.cumsum(keep) - 1  # old row -> row in the updated index
+
+    tmp_path = _new_directory(path)
+    vocab = dict(old.terms)
+    writer = _PostingsWriter(tmp_path)
+    # Postings are term-major, so slicing them in order keeps every term's rows increasing
+    for start in range(0, len(old.rows), POSTINGS_SLICE):
+        end = min(start + POSTINGS_SLICE, len(old.rows))
+        rows = np.asarray(old.rows[start:end])
+        terms = np.searchsorted(old.offsets, np.arange(start, end), side="right") - 1
+        kept = keep[rows]
+        writer.add(terms[kept], new_rows[rows[kept]], np.asarray(old.tfs[start:end])[kept])
+
+    fields = {}
+    for field, table in old.fields.items():
+        fields[field] = {}
+        for value, ids in table.items():
+            kept_ids = [i for i in ids if i not in removed]
+            if kept_ids:
+                fields[field][value] = kept_ids
+    row_ids, lengths = [old.row_ids[keep]], [old.lengths[keep]]
+    new_row_ids, new_lengths = _add_doc_batches(docs, new_ids, int(keep.sum()), vocab, writer, fields, batch_size)
+    return _finish(tmp_path, path, writer, vocab, row_ids + new_row_ids, lengths + new_lengths, fields)
+
+
+class BM25Index:
+    """Read side of build_bm25_index; postings are memory-mapped."""
+
+    def __init__(self, path, k1=BM25_K1, b=BM25_B):
+        self.k1, self.b = k1, b
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.rows = np.load(os.path.join(path, "rows.npy"), mmap_mode="r")
+        self.tfs = np.load(os.path.join(path, "tfs.npy"), mmap_mode="r")
+        self.row_ids = np.load(os.path.join(path, "row_ids.npy"))
+        self.lengths = np.load(os.path.join(path, "lengths.npy"))
+        with open(os.path.join(path, "terms.json"), "r", encoding="utf-8") as f:
+            self.terms = json.load(f)
+        with open(os.path.join(path, "fields.json"), "r", encoding="utf-8") as f:
+            self.fields = json.load(f)
+        self.asins = self.fields["asin"]
+        self.avg_length = float(self.lengths.mean()) if len(self.lengths) else 0.0
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    def named_asins(self, query_text):
+        """Indexed ASINs that appear as words of the query, in query order (one dict lookup per word)."""
+        words = dict.fromkeys(w.upper() for w in _WORD_RE.findall(query_text))
+        return [word for word in words if word in self.asins]
+
+    def lookup_asin(self, query_text):
+        """Chunk ids of every indexed product whose ASIN appears as a word of the query."""
+        return [doc_id for asin in self.named_asins(query_text) for doc_id in self.asins[asin]]
+
+    def filter_ids(self, filters):
+        """
+        Sorted ids of the chunks matching filters, {field: value or list of values}: any of
+        the values of a field, all of the fields. None values are ignored; returns None when
+        nothing is filtered.
+        """
+        selected = None
+        for field, values in filters.items():
+            if values is None:
+                continue
+            if field not in self.fields:
+                raise ValueError(f"❌ Unknown filter '{field}', expected one of {FILTER_FIELDS}")
+            if isinstance(values, str):
+                values = [values]
+            ids = {doc_id for value in values for doc_id in self.fields[field].get(_field_value(field, value), [])}
+            selected = ids if selected is None else selected & ids
+        return None if selected is None else np.asarray(sorted(selected), dtype=np.int64)
+
+    def search(self, query_text, k=4, ids=None):
+        """
+        Top-k [(chunk id, BM25 score)] for the query terms; [] when no term is indexed.
+        ids (sorted, from filter_ids) restricts the results to those chunks.
+        """
+        n = len(self.row_ids)
+        scores = np.zeros(n, dtype=np.float32)
+        for term in set(tokenize(query_text)):
+            index = self.terms.get(term)
+            if index is None:
+                continue
+            start, end = self.offsets[index], self.offsets[index + 1]
+            rows, tfs = self.rows[start:end], self.tfs[start:end]
+            df = end - start
+            idf = np.log((n - df + 0.5) / (df + 0.5) + 1.0)
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[rows] / self.avg_length)
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+        if ids is not None:
+            allowed = np.zeros(n, dtype=bool)
+            allowed[np.searchsorted(self.row_ids, ids)] = True
+            scores[~allowed] = 0.0
+        if not scores.any():
+            return []
+
+        k = min(k, int(np.count_nonzero(scores)))
+        top = np.argpartition(-scores, k - 1)[:k] if k < n else np.arange(n)
+        top = top[np.argsort(-scores[top], kind="stable")][:k]
+        return [(int(self.row_ids[row]), float(scores[row])) for row in top]
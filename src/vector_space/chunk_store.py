@@ -0,0 +1,227 @@
+# Memory-mapped chunk store: vectors in .npy, chunk texts in one offset-indexed blob and
+# metadata as one column per key. Nothing is unpickled and rows are decoded only when read.
+
+import os
+import json
+import shutil
+from collections.abc import Mapping
+
+import faiss
+import numpy as np
+from langchain.docstore.document import Document
+
+CHUNK_STORE_DTYPE = os.getenv("CHUNK_STORE_DTYPE", "float32")  # or float16 to halve vector storage
+MODALITIES = ("text", "image")
+SCHEMA_FILE = "schema.json"
+
+
+def _map_bytes(path):
+    """Read-only byte view of a file (np.memmap cannot map an empty file)."""
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode="r")
+
+
+def replace_directory(tmp_path, path):
+    """Swap a finished directory into place; processes that still map the old files keep reading them until they reload."""
+    old_path = f"{path}.old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+class _ColumnWriter:
+    """Appends variable-length byte values to <name>.bin and records their end offsets."""
+
+    def __init__(self, directory, name, rows_before=0):
+        self.name = name
+        self.blob = open(os.path.join(directory, f"{name}.bin"), "wb")
+        self.offsets = [0] * (rows_before + 1)  # rows written before the column existed are empty
+
+    def append(self, value=b""):
+        self.blob.write(value)
+        self.offsets.append(self.offsets[-1] + len(value))
+
+    def close(self, directory):
+        self.blob.close()
+        np.save(os.path.join(directory, f"{self.name}.offsets.npy"), np.asarray(self.offsets, dtype=np.int64))
+
+
+class _Column:
+    """Read side of _ColumnWriter: value(row) slices the mapped blob."""
+
+    def __init__(self, directory, name):
+        self.blob = _map_bytes(os.path.join(directory, f"{name}.bin"))
+        self.offsets = np.load(os.path.join(directory, f"{name}.offsets.npy"), mmap_mode="r")
+
+    def value(self, row):
+        return bytes(self.blob[self.offsets[row]:self.offsets[row + 1]])
+
+
+class ChunkStoreWriter:
+    """
+    Streams chunks (id, Document, text/image vectors) into a new chunk store directory.
+    Everything is written to <path>.tmp and swapped in by close(), so readers of the
+    previous store are never exposed to a partial one. Ids must be added in increasing order.
+    """
+
+    def __init__(self, path, vector_dtype=CHUNK_STORE_DTYPE):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.vector_dtype = np.dtype(vector_dtype)
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+
+        self.ids = []
+        self.text = _ColumnWriter(self.tmp_path, "page_content")
+        self.columns = {}  # metadata key -> _ColumnWriter of JSON-encoded values (b"" = key absent)
+        self.vector_files = {m: open(os.path.join(self.tmp_path, f"{m}_vectors.raw"), "wb") for m in MODALITIES}
+        self.dims = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+
+    def add(self, ids, docs, text_embs, image_embs):
+        ids = [int(i) for i in ids]
+        if ids and self.ids and ids[0] <= self.ids[-1]:
+            raise ValueError("❌ Chunk ids must be added in increasing order.")
+
+        for doc in docs:
+            row = len(self.text.offsets) - 1  # rows written so far
+            self.text.append(doc.page_content.encode("utf-8"))
+            for key in doc.metadata:
+                if key not in self.columns:
+                    self.columns[key] = _ColumnWriter(self.tmp_path, f"meta{len(self.columns)}", rows_before=row)
+            for key, column in self.columns.items():
+                if key in doc.metadata:
+                    column.append(json.dumps(doc.metadata[key], ensure_ascii=False).encode("utf-8"))
+                else:
+                    column.append()
+        self.ids.extend(ids)
+
+        for modality, embs in zip(MODALITIES, (text_embs, image_embs)):
+            embs = np.asarray(embs)
+            self.dims.setdefault(modality, embs.shape[1])
+            self.vector_files[modality].write(np.ascontiguousarray(embs, dtype=self.vector_dtype).tobytes())
+
+    def abort(self):
+        for f in (self.text.blob, *(c.blob for c in self.columns.values()), *self.vector_files.values()):
+            f.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def close(self):
+        """Finish the files and atomically replace the store at path. Returns the chunk count."""
+        n = len(self.ids)
+        self.text.close(self.tmp_path)
+        for column in self.columns.values():
+            column.close(self.tmp_path)
+        np.save(os.path.join(self.tmp_path, "ids.npy"), np.asarray(self.ids, dtype=np.int64))
+
+        # .raw -> .npy: the header needs the final row count, so copy the rows under it block by block
+        for modality, f in self.vector_files.items():
+            f.close()
+            raw_path = os.path.join(self.tmp_path, f"{modality}_vectors.raw")
+            dim = self.dims.get(modality, 0)
+            raw = np.memmap(raw_path, dtype=self.vector_dtype, mode="r", shape=(n, dim)) if n and dim else None
+            out = np.lib.format.open_memmap(os.path.join(self.tmp_path, f"{modality}_vectors.npy"), mode="w+",
+                                            dtype=self.vector_dtype, shape=(n, dim))
+            for start in range(0, n, 65536):
+                out[start:start + 65536] = raw[start:start + 65536]
+            out.flush()
+            del out, raw
+            os.remove(raw_path)
+
+        schema = {
+            "count": n,
+            "vector_dtype": self.vector_dtype.name,
+            "dims": self.dims,
+            "metadata_columns": {key: column.name for key, column in self.columns.items()},
+        }
+        with open(os.path.join(self.tmp_path, SCHEMA_FILE), "w", encoding="utf-8") as f:
+            json.dump(schema, f, indent=1)
+
+        replace_directory(self.tmp_path, self.path)
+        return n
+
+
+class ChunkStore(Mapping):
+    """
+    Read-only {id: Document} view of a chunk store directory.
+    All files are memory-mapped on open; a Document is decoded only when its id is looked up,
+    so opening the store costs the same for 1k or 10M chunks.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, SCHEMA_FILE), "r", encoding="utf-8") as f:
+            self.schema = json.load(f)
+        self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        self.text = _Column(path, "page_content")
+        self.columns = {key: _Column(path, name) for key, name in self.schema["metadata_columns"].items()}
+        # Opened now, with the id columns: a store swapped in later must not be read through this mapping
+        self._vectors = {m: np.load(os.path.join(path, f"{m}_vectors.npy"), mmap_mode="r") for m in MODALITIES}
+        # Fresh builds number chunks 0..n-1, so the row is the id itself
+        self._contiguous = len(self.ids) == 0 or (self.ids[0] == 0 and self.ids[-1] == len(self.ids) - 1)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return (int(i) for i in self.ids)
+
+    def row(self, doc_id):
+        """Row of doc_id in the column files (KeyError if it is not stored)."""
+        doc_id = int(doc_id)
+        if self._contiguous:
+            if 0 <= doc_id < len(self.ids):
+                return doc_id
+            raise KeyError(doc_id)
+        row = int(np.searchsorted(self.ids, doc_id))
+        if row == len(self.ids) or self.ids[row] != doc_id:
+            raise KeyError(doc_id)
+        return row
+
+    def __getitem__(self, doc_id):
+        row = self.row(doc_id)
+        metadata = {}
+        for key, column in self.columns.items():
+            value = column.value(row)
+            if value:
+                metadata[key] = json.loads(value)
+        return Document(page_content=self.text.value(row).decode("utf-8"), metadata=metadata)
+
+    def vectors(self, doc_ids, modality="text"):
+        """float32 vectors of doc_ids for modality ("text" or "image")."""
+        rows = [self.row(i) for i in doc_ids]
+        return np.asarray(self._vectors[modality][rows], dtype=np.float32)
+
+
+def _reconstruct(index, ids):
+    if not ids:
+        return np.zeros((0, index.d), dtype=np.float32)
+    try:
+        return np.vstack([index.reconstruct(i) for i in ids])
+    except RuntimeError:
+        # IVF indexes only reconstruct by id once their direct map is built
+        faiss.extract_index_ivf(index).make_direct_map()
+        return np.vstack([index.reconstruct(i) for i in ids])
+
+
+def migrate_docs(docs, path, text_index, image_index):
+    """
+    Write a chunk store for {id: Document} from an older build (JSONL docstore),
+    taking the vectors back out of the FAISS indexes.
+    """
+    ids = sorted(docs)
+    with ChunkStoreWriter(path) as writer:
+        writer.add(ids, [docs[i] for i in ids], _reconstruct(text_index, ids), _reconstruct(image_index, ids))
+        return writer.close()
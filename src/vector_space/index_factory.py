@@ -0,0 +1,136 @@
+# FAISS index types for the vector store: exact flat scan, approximate (IVF / PQ / HNSW)
+# or quantized flat codes (fp16 / int8 scalar quantizer, binary sign codes)
+
+import math
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq_fp16", "sq_int8", "binary")
+
+# Types whose stored vectors are lossy: search a k * rescore_factor shortlist, then rescore it in float32
+QUANTIZED_TYPES = ("ivf_pq", "sq_fp16", "sq_int8", "binary")
+
+
+def default_nlist(n_vectors):
+    """~4*sqrt(N) inverted lists, but never more than N/39 so every centroid gets enough training points."""
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+
+
+def create_index(dim, index_type="flat", n_vectors=0, nlist=None, pq_m=64, pq_nbits=8,
+                 hnsw_m=32, ef_construction=200):
+    """Return an empty (untrained) L2 index of the requested type."""
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+        return index
+    if index_type == "sq_fp16":
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16)
+    if index_type == "sq_int8":
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit)
+    if index_type == "binary":
+        # 1 bit per dimension (sign of each component), searched by Hamming distance
+        return faiss.IndexLSH(dim, dim, False, False)
+
+    nlist = nlist or default_nlist(n_vectors)
+    quantizer = faiss.IndexFlatL2(dim)
+    if index_type == "ivf_flat":
+        return faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_L2)
+    if index_type == "ivf_pq":
+        if dim % pq_m:
+            raise ValueError(f"❌ pq_m={pq_m} must divide the embedding dimension {dim}")
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits)
+
+    raise ValueError(f"❌ Unknown index_type '{index_type}', expected one of {INDEX_TYPES}")
+
+
+def min_training_points(index_type, nlist, pq_nbits=8):
+    if index_type == "ivf_flat":
+        return nlist
+    if index_type == "ivf_pq":
+        return max(nlist, 2 ** pq_nbits)
+    return 0
+
+
+def needs_training(index_type):
+    return index_type in ("ivf_flat", "ivf_pq", "sq_int8")
+
+
+def needs_rescoring(index_type):
+    return index_type in QUANTIZED_TYPES
+
+
+def train_index(sample, index_type="flat", id_map=False, train_sample=100_000, seed=0, debug=False, **params):
+    """
+    Create an empty index of index_type and, if the type needs it, train it on a random
+    subset of at most train_sample rows of sample.
+    With id_map, the index is wrapped in an IndexIDMap2 so rows are added with explicit
+    int64 ids (and can later be removed by id).
+    Falls back to a flat index when there are too few vectors to train on.
+    """
+    n, dim = sample.shape
+    if index_type in ("ivf_flat", "ivf_pq"):
+        params.setdefault("nlist", default_nlist(n))
+        needed = min_training_points(index_type, params["nlist"], params.get("pq_nbits", 8))
+        if n < needed:
+            print(f"⚠️ Warning: {n} vectors is too few to train {index_type} (needs {needed}), using flat")
+            index_type = "flat"
+
+    index = create_index(dim, index_type, n_vectors=n, **params)
+
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        subset = sample if n <= train_sample else sample[rng.choice(n, train_sample, replace=False)]
+        if debug:
+            print(f"[DEBUG] Training {index_type} index on {len(subset)} vectors")
+        index.train(np.ascontiguousarray(subset, dtype="float32"))
+
+    return faiss.IndexIDMap2(index) if id_map else index
+
+
+def build_index(embeddings, index_type="flat", ids=None, train_sample=100_000, seed=0, debug=False, **params):
+    """
+    Train an index of index_type on embeddings (see train_index) and add all of them,
+    under the given ids if any.
+    """
+    index = train_index(embeddings, index_type, id_map=ids is not None, train_sample=train_sample,
+                        seed=seed, debug=debug, **params)
+    if ids is None:
+        index.add(embeddings)
+    else:
+        index.add_with_ids(embeddings, np.asarray(ids, dtype="int64"))
+    return index
+
+
+def search_parameters(index, selector):
+    """
+    SearchParameters restricting a search to the ids of selector (a faiss.IDSelector), keeping
+    the index's own nprobe / efSearch. None for index types without selector support (binary).
+    """
+    inner = faiss.downcast_index(index.index if isinstance(index, faiss.IndexIDMap) else index)
+    if isinstance(inner, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=inner.nprobe)
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+    if isinstance(inner, faiss.IndexLSH):
+        return None
+    return faiss.SearchParameters(sel=selector)
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """
+    Tune query-time accuracy/speed: nprobe for IVF indexes, efSearch for HNSW.
+    Parameters that do not apply to the index type are ignored.
+    """
+    params = faiss.ParameterSpace()
+    if nprobe is not None:
+        try:
+            params.set_index_parameter(index, "nprobe", nprobe)
+        except RuntimeError:
+            pass
+    if ef_search is not None:
+        try:
+            params.set_index_parameter(index, "efSearch", ef_search)
+        except RuntimeError:
+            pass
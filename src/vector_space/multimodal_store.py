@@ -0,0 +1,251 @@
+# Vector store with separate text and image FAISS indexes and late score fusion
+
+import faiss
+import numpy as np
+
+from src.vector_space.index_factory import search_parameters
+
+FUSION_METHODS = ("weighted", "rrf")
+RRF_K = 60
+# A text-only query's top BM25 hit is kept in the results, even if CLIP misses it, when its score is at
+# least this multiple of the runner-up's (e.g. an exact model number or error code)
+KEYWORD_DOMINANCE = 2.0
+# Filtered searches over at most this many chunks skip FAISS and score them exactly on the stored vectors
+FILTER_EXACT_LIMIT = 2048
+
+
+def l2_to_cosine(distances):
+    """Squared L2 distance between unit vectors -> cosine similarity."""
+    return 1.0 - distances / 2.0
+
+
+def rescore(q_vec, ids, vectors, k):
+    """Exact float32 cosine of q_vec against the shortlist vectors; return the top-k [(id, score)]."""
+    if not ids:
+        return []
+    q = np.asarray(q_vec, dtype="float32").reshape(-1)
+    distances = ((np.asarray(vectors, dtype="float32") - q) ** 2).sum(axis=1)
+    order = np.argsort(distances, kind="stable")[:k]
+    return [(int(ids[i]), float(l2_to_cosine(distances[i]))) for i in order]
+
+
+class MultimodalStore:
+    """
+    Id i of text_index, image_index and docs (an {id: Document} mapping such as a
+    ChunkStore) all describe the same chunk.
+    Text queries scan only the 512-dim text index, image queries only the image index;
+    queries with both are searched per modality and the ranked lists fused.
+    With rescore_factor > 0 (quantized indexes), each search fetches a k * rescore_factor
+    shortlist and re-ranks it on the float32 vectors of docs (a ChunkStore).
+    With a keyword_index (BM25Index over the same ids), queries that name a known ASIN
+    return that product's chunks directly, and text queries fuse the CLIP ranking with
+    the BM25 ranking (RRF, keyword_weight for the BM25 side); a dominant BM25 hit is
+    always kept (KEYWORD_DOMINANCE).
+    filters ({"asin" | "category" | "source_file": value(s)}, resolved through the keyword
+    index) restrict every search to the matching chunks before the scan: FAISS only visits
+    ids accepted by an IDSelector, and scopes of up to FILTER_EXACT_LIMIT chunks (e.g. one
+    product) are scored directly on their vectors without touching the index.
+    """
+
+    def __init__(self, text_index, image_index, docs, rescore_factor=0, keyword_index=None, keyword_weight=0.3):
+        if text_index.ntotal != image_index.ntotal or text_index.ntotal != len(docs):
+            raise ValueError(
+                f"❌ Store is inconsistent: {text_index.ntotal} text vectors, "
+                f"{image_index.ntotal} image vectors, {len(docs)} docs — rebuild the index."
+            )
+        self.text_index = text_index
+        self.image_index = image_index
+        self.docs = docs
+        self.rescore_factor = rescore_factor
+        self.keyword_index = keyword_index
+        self.keyword_weight = keyword_weight
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _search(self, index, modality, q_vec, k, ids=None):
+        """
+        Return [(row_id, cosine score)] best-first, skipping empty result slots.
+        ids (sorted, from filter_ids) restricts the search to those rows.
+        """
+        q = np.ascontiguousarray(np.asarray(q_vec, dtype="float32").reshape(1, -1))
+        params = None
+        if ids is not None:
+            selector = faiss.IDSelectorBatch(ids)  # must outlive the search below
+            if len(ids) > FILTER_EXACT_LIMIT:
+                params = search_parameters(index, selector)
+            if params is None:  # small scope, or an index type without selector support
+                allowed = ids.tolist()
+                return rescore(q, allowed, self.docs.vectors(allowed, modality), k)
+
+        return self._search_many(index, modality, q, k, params)[0]
+
+    def _search_many(self, index, modality, queries, k, params=None):
+        """One index.search over a (n, dim) query matrix; [(row_id, cosine score)] best-first per query."""
+        if self.rescore_factor:
+            _, found = index.search(queries, k * self.rescore_factor, params=params)
+            results = []
+            for q, row in zip(queries, found):
+                shortlist = [int(i) for i in row if i != -1]
+                results.append(rescore(q, shortlist, self.docs.vectors(shortlist, modality), k))
+            return results
+
+        distances, found = index.search(queries, k, params=params)
+        return [[(int(i), float(s)) for i, s in zip(row, l2_to_cosine(dists)) if i != -1]
+                for row, dists in zip(found, distances)]
+
+    def _search_rows(self, index, modality, q_vecs, k):
+        """_search_many over the queries of q_vecs that are not None; None for the others."""
+        rows = [i for i, vec in enumerate(q_vecs) if vec is not None]
+        results = [None] * len(q_vecs)
+        if rows:
+            queries = np.stack([np.asarray(q_vecs[i], dtype="float32").reshape(-1) for i in rows])
+            queries = np.ascontiguousarray(queries)
+            for i, hits in zip(rows, self._search_many(index, modality, queries, k)):
+                results[i] = hits
+        return results
+
+    def search_text(self, q_vec, k=4, ids=None):
+        return self._search(self.text_index, "text", q_vec, k, ids)
+
+    def search_image(self, q_vec, k=4, ids=None):
+        return self._search(self.image_index, "image", q_vec, k, ids)
+
+    def search_keywords(self, query_text, k=4, ids=None):
+        """BM25 [(row_id, score)] best-first; [] without a keyword index."""
+        if self.keyword_index is None:
+            return []
+        return self.keyword_index.search(query_text, k, ids)
+
+    def exact_matches(self, query_text, k=4, ids=None):
+        """Rows of the products whose ASIN appears in query_text (first k, chunk order), or []."""
+        if self.keyword_index is None:
+            return []
+        rows = self.keyword_index.lookup_asin(query_text)
+        if ids is not None:
+            allowed = set(ids.tolist())
+            rows = [row for row in rows if row in allowed]
+        return rows[:k]
+
+    def named_asins(self, query_text):
+        """Catalog ASINs named in query_text, or [] without a keyword index."""
+        if self.keyword_index is None or not query_text:
+            return []
+        return self.keyword_index.named_asins(query_text)
+
+    def filter_ids(self, filters):
+        """Sorted ids of the chunks matching filters, or None when there is nothing to filter on."""
+        if not filters:
+            return None
+        if self.keyword_index is None:
+            raise ValueError("❌ Filtered search needs the keyword index — load the store with load_faiss_index.")
+        return self.keyword_index.filter_ids(filters)
+
+    @staticmethod
+    def fuse(text_hits, image_hits, k=4, fusion="weighted", text_weight=0.5):
+        """
+        Combine two ranked hit lists into one.
+        weighted: text_weight * text_cosine + (1 - text_weight) * image_cosine; a row missing
+                  from one list gets that list's lowest score (an upper bound on its true score).
+        rrf:      reciprocal-rank fusion, weighted the same way.
+        """
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"❌ Unknown fusion '{fusion}', expected one of {FUSION_METHODS}")
+
+        lists = []
+        for hits, weight in ((text_hits, text_weight), (image_hits, 1.0 - text_weight)):
+            if hits:
+                scores = dict(hits)
+                ranks = {row: rank for rank, (row, _) in enumerate(hits)}
+                lists.append((weight, scores, ranks, hits[-1][1]))
+
+        fused = {}
+        for row in dict.fromkeys(row for hits in (text_hits, image_hits) for row, _ in hits):
+            total = 0.0
+            for weight, scores, ranks, floor in lists:
+                if fusion == "rrf":
+                    if row in ranks:
+                        total += weight / (RRF_K + ranks[row] + 1)
+                else:
+                    total += weight * scores.get(row, floor)
+            fused[row] = total
+        return sorted(fused.items(), key=lambda x: x[1], reverse=True)[:k]
+
+    def search(self, text_vec=None, image_vec=None, k=4, fusion="weighted", text_weight=0.5, candidates=None,
+               query_text=None, filters=None, with_scores=False):
+        """
+        Return the top-k chunks as Documents for a text and/or image query vector
+        ([(Document, score)] with with_scores; exact ASIN matches score 1.0).
+        query_text (the raw text query) enables the exact-ASIN fast path and, for text-only
+        queries, hybrid BM25 + CLIP ranking. filters restricts the results to matching chunks.
+        """
+        ids = self.filter_ids(filters)
+        if ids is not None and not len(ids):
+            return []
+        text_hits = (lambda n: self.search_text(text_vec, n, ids)) if text_vec is not None else None
+        image_hits = (lambda n: self.search_image(image_vec, n, ids)) if image_vec is not None else None
+        hits = self._rank(k, fusion, text_weight, candidates, query_text, ids, text_hits, image_hits)
+        return self._documents(hits, with_scores)
+
+    def search_batch(self, text_vecs, image_vecs, k=4, query_texts=None, fusion="weighted", text_weight=0.5,
+                     candidates=None, with_scores=False):
+        """
+        search() for many unfiltered queries at once: every text vector goes through one search
+        of the text index and every image vector through one search of the image index.
+        text_vecs, image_vecs and query_texts are parallel lists with None where a query lacks
+        that part. Returns one result list per query.
+        """
+        query_texts = query_texts or [None] * len(text_vecs)
+        candidates = candidates or max(4 * k, 20)
+        all_text_hits = self._search_rows(self.text_index, "text", text_vecs, candidates)
+        all_image_hits = self._search_rows(self.image_index, "image", image_vecs, candidates)
+
+        results = []
+        for query_text, text_found, image_found in zip(query_texts, all_text_hits, all_image_hits):
+            # hits are best-first, so a shorter list is a prefix of the candidates fetched above
+            text_hits = (lambda n, found=text_found: found[:n]) if text_found is not None else None
+            image_hits = (lambda n, found=image_found: found[:n]) if image_found is not None else None
+            hits = self._rank(k, fusion, text_weight, candidates, query_text, None, text_hits, image_hits)
+            results.append(self._documents(hits, with_scores))
+        return results
+
+    def _documents(self, hits, with_scores):
+        if with_scores:
+            return [(self.docs[row], score) for row, score in hits]
+        return [self.docs[row] for row, _ in hits]
+
+    @staticmethod
+    def _keep_dominant_keyword_hit(fused, keyword_hits, k):
+        """
+        RRF alone cannot lift a chunk only BM25 finds above the CLIP candidates, so a top BM25
+        hit scoring KEYWORD_DOMINANCE times the runner-up (or the only hit) takes the first slot.
+        """
+        top_row, top_score = keyword_hits[0]
+        runner_up = keyword_hits[1][1] if len(keyword_hits) > 1 else 0.0
+        if top_score < KEYWORD_DOMINANCE * runner_up or any(row == top_row for row, _ in fused):
+            return fused
+        return [(top_row, fused[0][1] if fused else 1.0)] + fused[:k - 1]
+
+    def _rank(self, k, fusion, text_weight, candidates, query_text, ids, text_hits, image_hits):
+        """
+        Ranked [(row_id, score)] for one query. text_hits / image_hits map n to that modality's
+        n best hits, or are None when the query has no text / image vector.
+        """
+        if query_text:
+            rows = self.exact_matches(query_text, k, ids)
+            if rows:
+                return [(row, 1.0) for row in rows]
+        if text_hits is None and image_hits is None:
+            raise ValueError("❌ Provide a text and/or image query vector.")
+
+        candidates = candidates or max(4 * k, 20)
+        if image_hits is None:
+            keyword_hits = self.search_keywords(query_text, candidates, ids) if query_text else []
+            if keyword_hits:
+                fused = self.fuse(text_hits(candidates), keyword_hits, k=k, fusion="rrf",
+                                  text_weight=1.0 - self.keyword_weight)
+                return self._keep_dominant_keyword_hit(fused, keyword_hits, k)
+            return text_hits(k)
+        if text_hits is None:
+            return image_hits(k)
+        return self.fuse(text_hits(candidates), image_hits(candidates), k=k, fusion=fusion, text_weight=text_weight)
@@ -0,0 +1,141 @@
+# Parallel full rebuild: N worker processes each chunk + embed a shard of the catalog
+# into a partial flat index, then the shards are merged into the final index files
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
+import faiss
+import torch
+
+from src.ingestion.load_json_and_chunk import catalog_files, iter_batches, iter_catalog_chunks, iter_json_chunks
+from src.vector_space.chunk_store import ChunkStore, ChunkStoreWriter
+from src.vector_space.index_factory import build_index
+from src.vector_space.vectordb import (
+    BUILD_WORKERS, INDEX_TYPE, build_faiss_index, chunk_store_path, drop_legacy_docstore, image_index_path, load_manifest,
+    save_manifest, write_index, write_keyword_index,
+)
+
+
+def _build_shard(files, shard, shard_path, chunk_size, chunk_overlap, threads, debug):
+    """
+    Worker process: build a flat text/image index, chunk store and manifest for one shard.
+    Models are loaded lazily in the worker, so every process has its own CLIP/BLIP.
+    Returns shard_path, or None if the shard has no products.
+    """
+    torch.set_num_threads(threads)
+    faiss.omp_set_num_threads(threads)
+
+    chunks = iter_catalog_chunks(files, chunk_size, chunk_overlap, debug=debug, shard=shard)
+    first = next(chunks, None)
+    if first is None:
+        return None
+    build_faiss_index(chain([first], chunks), shard_path, debug=debug, index_type="flat")
+    return shard_path
+
+
+def merge_shards(shard_paths, index_path, index_type=INDEX_TYPE, train_sample=100_000, debug=True, **index_params):
+    """
+    Merge flat shard indexes into index_path (+ image index, chunk store, manifest).
+    Shard ids are offset so they stay unique; flat shards are concatenated with merge_from,
+    other index types are trained and filled once from the merged vectors.
+    """
+    text_index = image_index = None
+    manifest = {"index_type": index_type, "next_id": 0, "files": {}, "products": {}}
+
+    with ChunkStoreWriter(chunk_store_path(index_path)) as store:
+        for shard_path in shard_paths:
+            offset = manifest["next_id"]
+            shard_text = faiss.read_index(shard_path)
+            shard_image = faiss.read_index(image_index_path(shard_path))
+            if text_index is None:
+                text_index, image_index = shard_text, shard_image
+            else:
+                text_index.merge_from(shard_text, offset)
+                image_index.merge_from(shard_image, offset)
+
+            shard_store = ChunkStore(chunk_store_path(shard_path))
+            for batch_ids in iter_batches(shard_store, 4096):
+                store.add([i + offset for i in batch_ids], [shard_store[i] for i in batch_ids],
+                          shard_store.vectors(batch_ids, "text"), shard_store.vectors(batch_ids, "image"))
+
+            shard_manifest = load_manifest(shard_path)
+            manifest["files"].update(shard_manifest.get("files", {}))
+            for key, entry in shard_manifest.get("products", {}).items():
+                entry["ids"] = [i + offset for i in entry["ids"]]
+                manifest["products"][key] = entry
+            manifest["next_id"] += shard_manifest["next_id"]
+
+        if text_index is None:
+            raise ValueError("No chunks provided to merge_shards — check your data loader.")
+
+        if index_type != "flat":
+            ids = faiss.vector_to_array(text_index.id_map)
+            text_index, image_index = (
+                build_index(faiss.downcast_index(index.index).reconstruct_n(0, index.ntotal), index_type, ids=ids,
+                            train_sample=train_sample, debug=debug, **index_params)
+                for index in (text_index, image_index)
+            )
+
+        write_index(text_index, index_path)
+        write_index(image_index, image_index_path(index_path))
+        store.close()
+    write_keyword_index(index_path)
+    save_manifest(manifest, index_path)
+    drop_legacy_docstore(index_path)
+    return manifest["next_id"]
+
+
+def build_faiss_index_parallel(json_folder, index_path="Dataset/processed_data/faiss.index", workers=BUILD_WORKERS,
+                               chunk_size=300, chunk_overlap=50, debug=True, index_type=INDEX_TYPE,
+                               start_method="spawn", **index_params):
+    """
+    Full rebuild with `workers` processes. Products are dealt round-robin to the workers
+    (so a single large catalog file is split too); each worker uses cpu_count / workers
+    torch/FAISS threads. With workers <= 1 this is the serial build_faiss_index.
+    start_method "spawn" keeps torch state out of the children; use "fork" only when no
+    model has been loaded in the parent yet.
+    """
+    if workers <= 1:
+        chunks = iter_json_chunks(json_folder, chunk_size=chunk_size, chunk_overlap=chunk_overlap, debug=debug)
+        build_faiss_index(chunks, index_path, debug=debug, index_type=index_type, **index_params)
+        return
+
+    start_time = time.perf_counter()
+    files = catalog_files(json_folder)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    shard_dir = tempfile.mkdtemp(prefix="shards_", dir=os.path.dirname(index_path))
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context(start_method)) as pool:
+            futures = [
+                pool.submit(_build_shard, files, (i, workers), os.path.join(shard_dir, f"shard{i}.index"),
+                            chunk_size, chunk_overlap, threads, debug)
+                for i in range(workers)
+            ]
+            shard_paths = [p for p in (f.result() for f in futures) if p is not None]
+
+        n_docs = merge_shards(shard_paths, index_path, index_type=index_type, debug=debug, **index_params)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"\n✅ Merged {len(shard_paths)} shards into {index_type} indexes with {n_docs} docs")
+    print(f"⏱️ {elapsed:.1f}s total with {workers} workers, {n_docs / max(elapsed, 1e-9):.1f} chunks/sec")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the FAISS indexes with several worker processes.")
+    parser.add_argument("--json-folder", default="Dataset/text-data_json")
+    parser.add_argument("--index", default="Dataset/processed_data/faiss.index")
+    parser.add_argument("--workers", type=int, default=max(BUILD_WORKERS, os.cpu_count() or 1))
+    parser.add_argument("--index-type", default=INDEX_TYPE)
+    args = parser.parse_args()
+
+    build_faiss_index_parallel(args.json_folder, args.index, workers=args.workers, debug=False,
+                               index_type=args.index_type)
@@ -1,67 +1,376 @@
 import os
+import json
+import time
+from contextlib import contextmanager
 import faiss
-import pickle
 import numpy as np
-from src.embedding.image_embadding import embed_image
-from src.embedding.text_embedding import embed_text
-
-def build_faiss_index(chunks, index_path="Dataset/processed_data/faiss.index", debug=True):
-    docs = []
-    embeddings = []
-    metadata_list = []
-
-    if not chunks:
-        raise ValueError("No chunks provided to build_faiss_index — check your data loader.")
-
-    for i, chunk in enumerate(chunks):
-        if debug:
-            print(f"\n[DEBUG] Processing chunk {i+1}/{len(chunks)}")
-            print(f"Metadata: {chunk.metadata}")
-
-        # Text embedding
-        text_emb = embed_text(chunk.page_content, debug=debug)
-
-        # Image embedding
-        image_path = chunk.metadata.get("image_path", None)
-        if image_path and os.path.exists(image_path):
-            image_emb = embed_image(image_path, debug=debug)
-        else:
-            print(f"⚠️ Warning: Image path missing or not found for chunk {i}: {image_path}")
-            image_emb = np.zeros(text_emb.shape)  # same dimension as text embedding
-
-        # Sanity checks
-        if text_emb is None or text_emb.size == 0:
-            raise ValueError(f"❌ No text embedding for chunk {i}")
-        if image_emb is None or image_emb.size == 0:
-            raise ValueError(f"❌ No image embedding for chunk {i}")
-
-        # Combine embeddings
-        combined_emb = np.concatenate([text_emb, image_emb])
-        embeddings.append(combined_emb)
-        metadata_list.append(chunk.metadata)
-        docs.append(chunk)
-
-        if debug:
-            print(f"Combined embedding shape: {combined_emb.shape}")
-            print(f"First 5 values: {combined_emb[:5]}")
-
-    if not embeddings:
-        raise ValueError("❌ No embeddings created — check your embedding functions.")
-
-    embeddings = np.array(embeddings).astype("float32")
-    if embeddings.ndim == 1:
-        embeddings = embeddings[np.newaxis, :]
-
-    # Create FAISS index
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings)
-
-    # Save index and data
+from langchain.docstore.document import Document
+from src.embedding.image_embadding import embed_images
+from src.embedding.text_embedding import embed_texts
+from src.embedding.embedding_cache import embedding_cache_stats
+from src.vector_space.index_factory import train_index, needs_training
+from src.vector_space.chunk_store import ChunkStore, ChunkStoreWriter
+from src.vector_space.bm25_index import build_bm25_index, update_bm25_index
+from src.ingestion.load_json_and_chunk import iter_json_chunks, iter_batches, load_json_delta
+
+try:
+    import fcntl  # POSIX only: cross-process lock around index syncs
+except ImportError:
+    fcntl = None
+
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat")
+BUILD_WORKERS = int(os.getenv("BUILD_WORKERS", "1"))  # processes used for a full rebuild
+
+
+def chunk_store_path(index_path):
+    return index_path.replace(".index", "_chunks")
+
+
+def docstore_path(index_path):
+    """JSONL docstore of older builds (replaced by the chunk store, read only for migration)."""
+    return index_path.replace(".index", "_docstore.jsonl")
+
+
+def keyword_index_path(index_path):
+    return index_path.replace(".index", "_bm25")
+
+
+def write_keyword_index(index_path):
+    """(Re)build the BM25 / exact-ASIN index from the chunk store; returns the chunk count."""
+    return build_bm25_index(ChunkStore(chunk_store_path(index_path)), keyword_index_path(index_path))
+
+
+def update_keyword_index(index_path, removed_ids, new_ids):
+    """Apply an update to the BM25 index, tokenizing only new_ids; rebuilt if it drifted from the chunk store."""
+    store = ChunkStore(chunk_store_path(index_path))
+    if update_bm25_index(keyword_index_path(index_path), store, removed_ids, new_ids) != len(store):
+        return write_keyword_index(index_path)
+    return len(store)
+
+
+def image_index_path(index_path):
+    return index_path.replace(".index", "_image.index")
+
+
+def manifest_path(index_path):
+    return index_path.replace(".index", "_manifest.json")
+
+
+def _atomic_write(path, write_fn):
+    """Write to path.tmp and rename, so readers never see a half-written file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        write_fn(f)
+    os.replace(tmp_path, path)
+
+
+def write_index(index, path):
+    """faiss.write_index via a temp file, so processes that memory-map path keep a valid file."""
+    tmp_path = f"{path}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_docstore(path):
+    """Read the JSONL docstore of an older build as {id: Document}."""
+    docs = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for position, line in enumerate(f):
+            if line.strip():
+                row = json.loads(line)
+                docs[row.get("id", position)] = Document(page_content=row["page_content"], metadata=row["metadata"])
+    return docs
+
+
+def drop_legacy_docstore(index_path):
+    """Delete the JSONL docstore of an older build once a chunk store has replaced it."""
+    if os.path.exists(docstore_path(index_path)):
+        os.remove(docstore_path(index_path))
+
+
+def load_manifest(index_path):
+    """Per-file / per-product hashes and chunk ids of the current index ({} if there is none)."""
+    path = manifest_path(index_path)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, index_path):
+    _atomic_write(manifest_path(index_path), lambda f: json.dump(manifest, f, indent=1))
+
+
+def _add_to_manifest(manifest, docs, ids):
+    """Record each chunk's id under its product, and its source file hash."""
+    files, products = manifest.setdefault("files", {}), manifest.setdefault("products", {})
+    for doc_id, doc in zip(ids, docs):
+        meta = doc.metadata
+        key = meta.get("product_key")
+        if key is None:
+            continue
+        entry = products.setdefault(key, {"hash": meta.get("content_hash"), "source_file": meta.get("source_file"),
+                                          "ids": []})
+        entry["ids"].append(int(doc_id))
+        if meta.get("file_hash"):
+            files[meta["source_file"]] = meta["file_hash"]
+
+
+def _embed_chunks(docs, text_batch_size=32, image_batch_size=16, debug=True, image_cache=None):
+    """
+    Return (text_embs, image_embs), one row per chunk.
+    Chunk texts are embedded text_batch_size at a time; every distinct image_path is
+    embedded once (image_batch_size per forward pass) and its vector shared by all its chunks.
+    image_cache ({path: vector}) carries image vectors over from the previous batch, so a
+    product whose chunks straddle two batches is not embedded twice; it is trimmed to the
+    images of this batch on return.
+    """
+    image_cache = {} if image_cache is None else image_cache
+    metadata_list = [chunk.metadata for chunk in docs]
+
+    # Text embeddings, batched
+    text_embs = embed_texts([chunk.page_content for chunk in docs], batch_size=text_batch_size, debug=debug)
+    if text_embs.shape[0] != len(docs):
+        raise ValueError(f"❌ Expected {len(docs)} text embeddings, got {text_embs.shape[0]}")
+
+    # Image embeddings, one forward pass per distinct image
+    image_paths = [meta.get("image_path", None) for meta in metadata_list]
+    distinct_paths = list(dict.fromkeys(p for p in image_paths if p))
+    new_paths = [p for p in distinct_paths if p not in image_cache]
+    found_paths = [p for p in new_paths if os.path.exists(p)]
+    for p in new_paths:
+        if p not in found_paths:
+            print(f"⚠️ Warning: Image path not found: {p}")
+
+    image_embs = embed_images(found_paths, batch_size=image_batch_size, debug=debug)
+    image_cache.update(zip(found_paths, image_embs))
+    zeros = np.zeros(text_embs.shape[1], dtype="float32")  # same dimension as text embedding
+
+    if debug:
+        print(f"\n[DEBUG] {len(found_paths)} distinct images embedded for {len(docs)} chunks")
+
+    # Fan image vectors out to their chunks (zeros when the chunk has no image)
+    chunk_image_embs = np.empty_like(text_embs)
+    for i, image_path in enumerate(image_paths):
+        if not image_path:
+            print(f"⚠️ Warning: Image path missing for chunk {i}")
+        chunk_image_embs[i] = image_cache.get(image_path, zeros)
+
+    for p in [p for p in image_cache if p not in distinct_paths]:
+        del image_cache[p]
+
+    if debug:
+        print(f"Text / image embedding shapes: {text_embs.shape} / {chunk_image_embs.shape}")
+        print(f"First 5 values: {text_embs[0][:5]}")
+
+    return text_embs, chunk_image_embs
+
+
+def _print_cache_stats():
+    stats = embedding_cache_stats()
+    print("🗃️ Embedding cache: " + ", ".join(
+        f"{kind} {s['hits']} hits / {s['misses']} misses" for kind, s in stats.items()))
+
+
+def build_faiss_index(chunks, index_path="Dataset/processed_data/faiss.index", debug=True,
+                      text_batch_size=32, image_batch_size=16, index_type=INDEX_TYPE,
+                      ingest_batch_size=1024, train_sample=100_000, **index_params):
+    """
+    Embed all chunks and write the text index (index_path), the image index
+    (<name>_image.index), the chunk store (<name>_chunks/), the BM25 keyword index
+    (<name>_bm25/) and the manifest used for incremental updates.
+    chunks may be any iterable (e.g. iter_json_chunks): it is consumed ingest_batch_size chunks
+    at a time and each batch is embedded, appended to the chunk store and added to the
+    indexes before the next one is read. IVF types first buffer up to train_sample vectors
+    to train on, so memory is bounded by the batch/training sizes plus the index itself.
+    Chunk i gets id i in both indexes (IndexIDMap2) and in the chunk store.
+    index_type is one of index_factory.INDEX_TYPES ("flat", "ivf_flat", "ivf_pq", "hnsw");
+    index_params (nlist, pq_m, hnsw_m, ...) are passed to train_index.
+    """
+    start_time = time.perf_counter()
     os.makedirs(os.path.dirname(index_path), exist_ok=True)
-    faiss.write_index(index, index_path)
-    with open(index_path.replace(".index", "_store.pkl"), "wb") as f:
-        pickle.dump((docs, embeddings, metadata_list), f)
 
-    print(f"\n✅ FAISS index built with {len(docs)} docs, dimension {dim}")
+    manifest = {"index_type": index_type, "next_id": 0}
+    indexes = None
+    pending = []  # (ids, text_embs, image_embs) held back until the indexes are trained
+    buffered = 0
+    train_size = train_sample if needs_training(index_type) else 0
+    image_cache = {}
+
+    def create_indexes():
+        ids, text_embs, image_embs = (np.concatenate(parts) for parts in zip(*pending))
+        trained = [train_index(embs, index_type, id_map=True, train_sample=train_sample, debug=debug,
+                               **index_params) for embs in (text_embs, image_embs)]
+        trained[0].add_with_ids(text_embs, ids)
+        trained[1].add_with_ids(image_embs, ids)
+        pending.clear()
+        return trained
+
+    with ChunkStoreWriter(chunk_store_path(index_path)) as store:
+        for batch in iter_batches(chunks, ingest_batch_size):
+            text_embs, image_embs = _embed_chunks(batch, text_batch_size, image_batch_size, debug, image_cache)
+            ids = np.arange(manifest["next_id"], manifest["next_id"] + len(batch), dtype="int64")
+            store.add(ids, batch, text_embs, image_embs)
+            _add_to_manifest(manifest, batch, ids)
+            manifest["next_id"] += len(batch)
+
+            if indexes is None:
+                pending.append((ids, text_embs, image_embs))
+                buffered += len(batch)
+                if buffered >= train_size:
+                    indexes = create_indexes()
+            else:
+                indexes[0].add_with_ids(text_embs, ids)
+                indexes[1].add_with_ids(image_embs, ids)
+
+            if debug:
+                print(f"[DEBUG] {manifest['next_id']} chunks ingested")
+
+        n_docs = manifest["next_id"]
+        if n_docs == 0:
+            raise ValueError("No chunks provided to build_faiss_index — check your data loader.")
+        if indexes is None:
+            indexes = create_indexes()
+
+        # Save indexes and data
+        write_index(indexes[0], index_path)
+        write_index(indexes[1], image_index_path(index_path))
+        store.close()
+    write_keyword_index(index_path)
+    save_manifest(manifest, index_path)
+    drop_legacy_docstore(index_path)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"\n✅ FAISS text + image indexes ({index_type}) built with {n_docs} docs, dimension {indexes[0].d}")
+    print(f"⏱️ {elapsed:.1f}s total, {n_docs / max(elapsed, 1e-9):.1f} chunks/sec")
+    _print_cache_stats()
+
+
+def update_faiss_index(chunks, removed_keys, file_hashes, index_path="Dataset/processed_data/faiss.index",
+                       debug=True, text_batch_size=32, image_batch_size=16):
+    """
+    Apply a catalog delta (from load_json_delta) to an existing build in place:
+    remove the chunk ids of removed_keys from both indexes and the chunk store, then embed
+    and add the new chunks under fresh ids. The BM25 index is updated with the delta
+    (only the new chunks are tokenized). Trained structures (IVF centroids, PQ codebooks)
+    are reused as they are.
+    Returns False, leaving the files untouched, if the index cannot be updated incrementally
+    (no manifest or chunk store, not an id-mapped index, or an index type without remove
+    support such as HNSW).
+    """
+    manifest = load_manifest(index_path)
+    if "next_id" not in manifest or not os.path.isdir(chunk_store_path(index_path)):
+        return False
+
+    start_time = time.perf_counter()
+    indexes = [faiss.read_index(path) for path in (index_path, image_index_path(index_path))]
+    if not all(isinstance(index, faiss.IndexIDMap) for index in indexes):
+        return False
+
+    products = manifest["products"]
+    remove_ids = np.array([i for key in removed_keys for i in products.get(key, {}).get("ids", [])], dtype="int64")
+    if len(remove_ids):
+        try:
+            for index in indexes:
+                index.remove_ids(remove_ids)
+        except RuntimeError as e:
+            print(f"⚠️ Warning: {manifest.get('index_type')} index does not support removal ({e})")
+            return False
+
+    for key in removed_keys:
+        products.pop(key, None)
+
+    old_store = ChunkStore(chunk_store_path(index_path))
+    removed = set(remove_ids.tolist())
+    kept_ids = [doc_id for doc_id in old_store if doc_id not in removed]
+    with ChunkStoreWriter(chunk_store_path(index_path), old_store.schema["vector_dtype"]) as store:
+        # Surviving rows are copied over (vectors included) in id order, then the new chunks appended
+        for batch_ids in iter_batches(kept_ids, 4096):
+            store.add(batch_ids, [old_store[i] for i in batch_ids],
+                      old_store.vectors(batch_ids, "text"), old_store.vectors(batch_ids, "image"))
+
+        new_ids = np.zeros(0, dtype="int64")
+        if chunks:
+            new_docs = list(chunks)
+            text_embs, image_embs = _embed_chunks(new_docs, text_batch_size, image_batch_size, debug)
+            new_ids = np.arange(manifest["next_id"], manifest["next_id"] + len(new_docs), dtype="int64")
+            indexes[0].add_with_ids(text_embs, new_ids)
+            indexes[1].add_with_ids(image_embs, new_ids)
+            store.add(new_ids, new_docs, text_embs, image_embs)
+            manifest["next_id"] += len(new_docs)
+            _add_to_manifest(manifest, new_docs, new_ids)
+
+        manifest["files"] = dict(file_hashes)
+
+        write_index(indexes[0], index_path)
+        write_index(indexes[1], image_index_path(index_path))
+        n_docs = store.close()
+    update_keyword_index(index_path, remove_ids, new_ids)
+    save_manifest(manifest, index_path)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"\n✅ FAISS index updated: -{len(remove_ids)} / +{len(chunks)} chunks, {n_docs} total "
+          f"({elapsed:.1f}s)")
+    _print_cache_stats()
+    return True
+
+
+@contextmanager
+def index_lock(index_path):
+    """
+    Exclusive lock on <index_path>.lock for the duration of the block, so concurrent syncs
+    (other threads or processes, e.g. API workers) never write the same tmp files.
+    Without fcntl (Windows) the block runs unlocked.
+    """
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    with open(f"{index_path}.lock", "w") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def sync_faiss_index(json_folder, index_path="Dataset/processed_data/faiss.index", chunk_size=300,
+                     chunk_overlap=50, debug=True, workers=BUILD_WORKERS):
+    """
+    Bring the index in line with the JSON catalog: build it if missing (or built without a
+    manifest), otherwise re-chunk and re-embed only new or changed products.
+    Full builds use `workers` processes (parallel_build) when workers > 1.
+    Runs under index_lock, one sync per index at a time.
+    Returns True if the files on disk changed.
+    """
+    with index_lock(index_path):
+        return _sync_faiss_index(json_folder, index_path, chunk_size, chunk_overlap, debug, workers)
+
+
+def _sync_faiss_index(json_folder, index_path, chunk_size, chunk_overlap, debug, workers):
+    manifest = load_manifest(index_path)
+    if os.path.exists(index_path) and manifest:
+        chunks, removed_keys, file_hashes = load_json_delta(json_folder, manifest, chunk_size, chunk_overlap,
+                                                            debug=debug)
+        if not chunks and not removed_keys:
+            if file_hashes != manifest.get("files"):
+                manifest["files"] = file_hashes
+                save_manifest(manifest, index_path)
+            print("Index is up to date with the catalog.")
+            return False
+        if update_faiss_index(chunks, removed_keys, file_hashes, index_path, debug=debug):
+            return True
+        print("Index cannot be updated incrementally. Rebuilding...")
+    elif os.path.exists(index_path):
+        print("Index has no manifest (older build). Rebuilding once to enable incremental updates...")
+    else:
+        print("No index found. Building new FAISS index...")
+
+    if workers > 1:
+        from src.vector_space.parallel_build import build_faiss_index_parallel  # imports this module
+        build_faiss_index_parallel(json_folder, index_path, workers=workers, chunk_size=chunk_size,
+                                   chunk_overlap=chunk_overlap, debug=debug)
+        return True
 
+    chunks = iter_json_chunks(json_folder, chunk_size=chunk_size, chunk_overlap=chunk_overlap, debug=debug)
+    build_faiss_index(chunks, index_path, debug=debug)
+    return True
@@ -1,20 +1,21 @@
 import streamlit as st
-from pathlib import Path
 from src.rag_pipeline.retriever import (
     load_faiss_index,
-    retrieve_by_text,
+    embed_query_text,
+    search_by_vector,
     retrieve_by_image,
     retrieve_by_text_and_image
 )
-from src.ingestion.load_json_and_chunk import load_json_data
-from src.vector_space.vectordb import build_faiss_index
+from src.vector_space.vectordb import sync_faiss_index
 from src.utils.prompt_builder import build_prompt
-from src.utils.run_llm import run_llm
-import tempfile, shutil, os
+from src.utils.run_llm import stream_llm
+from src.rag_pipeline.answer_cache import answer_cache, cache_scope
+from src.utils.uploads import decode_upload
 
 # -------------------- Config --------------------
 INDEX_PATH = "Dataset/processed_data/faiss.index"
 JSON_PATH = "Dataset/text-data_json"
+TOP_K = 4
 
 # -------------------- Streamlit UI --------------------
 st.set_page_config(page_title="Multimodal Customer Support RAG", layout="wide")
@@ -27,72 +28,75 @@ query_image = st.file_uploader("Upload Image", type=["png", "jpg", "jpeg"])
 
 if query_image:
     st.image(query_image, caption="Uploaded Image", width=256)
+    text_weight = st.slider("Text vs. image weight (text + image queries)", min_value=0.0, max_value=1.0, value=0.5)
 
 submit_btn = st.button("Generate Answer")
 
 # -------------------- Load or Build FAISS --------------------
 @st.cache_resource(show_spinner=True)
 def load_or_build_index():
-    if not Path(INDEX_PATH).exists():
-        st.info("No FAISS index found. Building new index...")
-        chunks = load_json_data(JSON_PATH, chunk_size=300, chunk_overlap=50, debug=False)
-        build_faiss_index(chunks, INDEX_PATH, debug=True)
-        st.success("✅ FAISS index built successfully.")
+    if sync_faiss_index(JSON_PATH, INDEX_PATH, chunk_size=300, chunk_overlap=50, debug=False):
+        st.success("✅ FAISS index built / updated from the catalog.")
     vectorstore = load_faiss_index(INDEX_PATH)
     return vectorstore
 
 vectorstore = load_or_build_index()
 
-# -------------------- Helper: Temp save uploaded image --------------------
-def save_uploaded_image(uploaded_file):
-    tmp_dir = tempfile.mkdtemp()
-    tmp_path = Path(tmp_dir) / uploaded_file.name
-    with open(tmp_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    return tmp_path, tmp_dir
-
 # -------------------- Answer Generation --------------------
 if submit_btn:
     if not query_text and not query_image:
         st.warning("⚠️ Please provide text or upload an image (or both).")
     else:
-        image_path, tmp_dir = (None, None)
-        if query_image:
-            image_path, tmp_dir = save_uploaded_image(query_image)
-
         try:
-            # Retrieve docs
-            if query_text and image_path:
-                docs = retrieve_by_text_and_image(vectorstore, query_text, str(image_path), k=4)
-            elif query_text:
-                docs = retrieve_by_text(vectorstore, query_text, k=4)
-            elif image_path:
-                docs = retrieve_by_image(vectorstore, str(image_path), k=4)
+            # Decode the upload once in memory; CLIP and BLIP both take the PIL image
+            upload = decode_upload(query_image.getvalue()) if query_image else None
+
+            # Text-only questions can be answered from the semantic answer cache
+            q_vec, cached = None, None
+            if query_text and not upload:
+                scope = cache_scope(TOP_K, asins=vectorstore.named_asins(query_text))
+                q_vec = embed_query_text(query_text)
+                cached = answer_cache.lookup(q_vec, scope=scope)
+
+            if cached is not None:
+                st.markdown("### 🟢 LLM Answer:")
+                st.markdown(cached["answer"])
+                st.success("✅ Answer served from cache!")
             else:
-                docs = []
-
-            # # Show retrieved docs
-            # st.markdown("#### 🔍 Retrieved Documents/Chunks:")
-            # if docs:
-            #     for i, doc in enumerate(docs):
-            #         doc_text = doc.page_content if hasattr(doc, "page_content") else str(doc)
-            #         st.markdown(f"**Chunk {i+1}:** {doc_text}")
-            # else:
-            #     st.info("No relevant documents found.")
-
-            # Build prompt and run LLM
-            prompt = build_prompt(query_text or "", docs, query_image_path=str(image_path) if image_path else None)
-            with st.spinner("Generating answer..."):
-                answer = run_llm(prompt)
-            st.success("✅ Answer generated!")
-            st.markdown("### 🟢 LLM Answer:")
-            st.text_area("LLM Answer", value=answer, height=300, label_visibility="collapsed")
+                # Retrieve docs
+                if query_text and upload:
+                    docs = retrieve_by_text_and_image(vectorstore, query_text, upload.image, k=TOP_K, text_weight=text_weight)
+                elif query_text:
+                    docs = search_by_vector(vectorstore, q_vec, k=TOP_K, query_text=query_text)
+                elif upload:
+                    docs = retrieve_by_image(vectorstore, upload.image, k=TOP_K)
+                else:
+                    docs = []
+
+                # # Show retrieved docs
+                # st.markdown("#### 🔍 Retrieved Documents/Chunks:")
+                # if docs:
+                #     for i, doc in enumerate(docs):
+                #         doc_text = doc.page_content if hasattr(doc, "page_content") else str(doc)
+                #         st.markdown(f"**Chunk {i+1}:** {doc_text}")
+                # else:
+                #     st.info("No relevant documents found.")
+
+                # Show which products the answer is grounded on, before generation starts
+                context = [{"product_name": d.metadata.get("product_name", "Unknown"),
+                            "asin": d.metadata.get("asin", "?")} for d in docs]
+                if context:
+                    st.caption("Context: " + " · ".join(f"{c['product_name']} ({c['asin']})" for c in context))
+
+                # Build prompt and stream the LLM answer as it is generated
+                prompt = build_prompt(query_text or "", docs, query_image=upload)
+                st.markdown("### 🟢 LLM Answer:")
+                answer = st.write_stream(stream_llm(prompt))
+                st.success("✅ Answer generated!")
+                if q_vec is not None:
+                    answer_cache.store(q_vec, {"answer": answer, "context": context}, scope=scope)
         except Exception as e:
             st.error(f"❌ Error: {e}")
-        finally:
-            # Cleanup temp image
-            if tmp_dir and os.path.exists(tmp_dir):
-                shutil.rmtree(tmp_dir)
 
 
 
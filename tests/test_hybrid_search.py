@@ -0,0 +1,43 @@
+import faiss
+import numpy as np
+from langchain.docstore.document import Document
+
+from src.vector_space.bm25_index import BM25Index, build_bm25_index
+from src.vector_space.multimodal_store import MultimodalStore
+
+DIM = 8
+
+
+def _unit(v):
+    v = np.asarray(v, dtype="float32")
+    return v / np.linalg.norm(v)
+
+
+def _index(vectors):
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(DIM))
+    index.add_with_ids(np.stack(vectors), np.arange(len(vectors), dtype="int64"))
+    return index
+
+
+def test_keyword_only_match_reaches_top_k(tmp_path):
+    rng = np.random.default_rng(0)
+    query_vec = _unit(np.ones(DIM))
+    texts = [f"Router model r-{i} firmware update and reset steps" for i in range(30)]
+    texts.append("Error E-7 on the X-200 after a firmware update: hold reset for ten seconds")
+    # Every router chunk sits close to the query in CLIP space, the X-200 chunk far from it
+    vectors = [_unit(query_vec + 0.1 * rng.standard_normal(DIM)) for _ in range(30)]
+    vectors.append(_unit(-query_vec))
+    docs = {i: Document(page_content=text, metadata={"asin": f"A{i}"}) for i, text in enumerate(texts)}
+
+    build_bm25_index(docs, str(tmp_path / "bm25"))
+    store = MultimodalStore(_index(vectors), _index(vectors), docs, keyword_index=BM25Index(str(tmp_path / "bm25")))
+
+    assert 30 not in [row for row, _ in store.search_text(query_vec, 20)]  # CLIP alone misses it
+    results = store.search(text_vec=query_vec, k=4, query_text="x-200 firmware")
+    assert results[0].page_content == texts[30]
+
+
+def test_keyword_hit_without_dominance_keeps_rrf_order():
+    fused = [(1, 0.02), (2, 0.01)]
+    assert MultimodalStore._keep_dominant_keyword_hit(fused, [(9, 3.0), (1, 2.0)], k=2) == fused
+    assert MultimodalStore._keep_dominant_keyword_hit(fused, [(9, 6.0), (1, 2.0)], k=2) == [(9, 0.02), (1, 0.02)]